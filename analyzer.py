@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 09:12:40 2026
+@author: thabata
+
+NLTK is only imported by make_analyzer (and word_tokenize only for the
+NLTK tokenizer), so importing this module stays cheap
+"""
+
+import re
+import time
+
+NUMBER = re.compile(r'^\d*[.,]?\d*$')
+WORD = re.compile(r"\w+(?:[-'.]\w+)*")
+
+STAGES = ['tokenize', 'filter', 'stem']
+
+
+
+class Analyzer:
+    """
+shared text analysis for documents (inverted_index) and queries
+(query_processor):
+- splits text with word_tokenize (or the regex fast path)
+- removes stop words, small words (1-2 chars) and numbers
+- stems (or not) and upper cases the remaining tokens
+token -> stem results are memoized in a bounded cache (cleared when full)
+counters[stage] = [items out of the stage, seconds spent in the stage]
+    """
+
+    def __init__(self, stop, stemmer=None, fast=False, cache_size=100000):
+        self.stop = stop
+        self.stemmer = stemmer
+        if fast:
+            self.split = WORD.findall
+        else:
+            from nltk.tokenize import word_tokenize
+            self.split = word_tokenize
+        self.cache = {}
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self.reset_counters()
+
+
+    def reset_counters(self):
+        """
+zeroes the throughput counters and the cache statistics
+        """
+        self.counters = {stage: [0, 0.] for stage in STAGES}
+        self.counters['docs'] = [0, 0.]
+        self.hits = 0
+        self.misses = 0
+
+
+    def merge_counters(self, stats):
+        """
+adds counters collected by another analyzer (e.g. in a pool worker)
+stats is the tuple returned by snapshot()
+        """
+        counters, hits, misses = stats
+        for stage, (items, seconds) in counters.items():
+            self.counters[stage][0] += items
+            self.counters[stage][1] += seconds
+        self.hits += hits
+        self.misses += misses
+
+
+    def snapshot(self):
+        """
+returns tuple: (counters, cache hits, cache misses)
+        """
+        return ({k: list(v) for k, v in self.counters.items()},
+                self.hits, self.misses)
+
+
+    def normalize(self, tok):
+        """
+stems and upper cases one token, going through the memo cache
+        """
+        try:
+            norm = self.cache[tok]
+            self.hits += 1
+            return norm
+        except KeyError:
+            self.misses += 1
+
+        norm = self.stemmer.stem(tok) if self.stemmer else tok
+        norm = norm.upper()
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache[tok] = norm
+        return norm
+
+
+    def analyze(self, text):
+        """
+tokenizes and pre-processes one text
+returns array of tokens
+        """
+        counters = self.counters
+        stop = self.stop
+        number = NUMBER.match
+
+        t0 = time.perf_counter()
+        toks = self.split(text)
+        t1 = time.perf_counter()
+        n_split = len(toks)
+        toks = [tok for tok in toks
+                    if not tok in stop
+                    if len(tok)>2
+                    if number(tok)==None]
+        t2 = time.perf_counter()
+        toks = [self.normalize(tok) for tok in toks]
+        t3 = time.perf_counter()
+
+        counters['tokenize'][0] += n_split
+        counters['tokenize'][1] += t1 - t0
+        counters['filter'][0] += len(toks)
+        counters['filter'][1] += t2 - t1
+        counters['stem'][0] += len(toks)
+        counters['stem'][1] += t3 - t2
+        counters['docs'][0] += 1
+        counters['docs'][1] += t3 - t0
+        return toks
+
+
+    def analyze_all(self, docs):
+        """
+tokenizes and pre-processes every text in docs
+returns array of arrays (list of tokens in each document)
+        """
+        return [self.analyze(doc) for doc in docs]
+
+
+    def report(self):
+        """
+returns array of log lines with the throughput of each stage
+        """
+        lines = []
+        for stage in ['docs'] + STAGES:
+            items, seconds = self.counters[stage]
+            rate = items/seconds if seconds else 0.
+            lines.append('%s: %s items in %.3f s (%.0f items/s)' %
+                         (stage, items, seconds, rate))
+        lookups = self.hits + self.misses
+        lines.append('stem cache: %s hits, %s misses (%.1f%% hit rate)' %
+                     (self.hits, self.misses,
+                      100.*self.hits/lookups if lookups else 0.))
+        return lines
+
+
+
+def make_analyzer(use_mode, tokenizer_mode='NLTK', cache_size=100000):
+    """
+builds the analyzer for a MODO_DE_USO (STEMMER or NOSTEMMER) and a
+TOKENIZADOR (NLTK or REGEX) configuration
+returns Analyzer, or None if the use mode is undefined
+    """
+    if use_mode == 'STEMMER':
+        from nltk.stem.porter import PorterStemmer
+        stemmer = PorterStemmer()
+    elif use_mode == 'NOSTEMMER':
+        stemmer = None
+    else:
+        return None
+
+    from nltk.corpus import stopwords
+    return Analyzer(set(stopwords.words('english')),
+                    stemmer,
+                    tokenizer_mode == 'REGEX',
+                    cache_size)
@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 21:05:52 2026
+@author: thabata
+
+startup benchmark: wall time of a fresh interpreter importing each entry
+point (median of REPETICOES runs, interpreter start included), the import
+time of the module itself (python -X importtime) and of the heavy
+dependencies it pulls in
+with REFERENCIA= (a previous output of this benchmark), modules slower than
+the reference by more than TOLERANCIA percent are reported as regressions
+
+scaling benchmark, only with ESCALAS= (e.g. 1,10,100; commented out in
+bm.cfg: the scale 100 corpus alone takes minutes and ~850 MB): a synthetic
+collection per scale (synthetic.py, CORPUS= directory, generated once per
+scale and seed) goes through every stage of the pipeline, each one in its
+own process configured as in this repository (only the input files, and
+TOPK= of the searcher when given, are changed); wall time, throughput and
+peak RSS (os.wait4) of each stage are appended to ESCALA=, with the commit
+they were measured on
+the number of queries is the same at every scale (CONSULTAS=, default as
+many as CF), so the per-query cost of the searcher shows how it scales with
+the collection
+scale 1000 is accepted but left out of the examples: peak RSS grows about
+linearly with the scale (at 100: inverted_index 0.2 GB in stream mode,
+indexer 1.3 GB, which builds the whole TF*IDF model in memory, ~0.85 GB of
+xml), so 1000 needs ~13 GB of RAM for the indexer and ~9 GB of disk; on a
+smaller machine the stage fails, its scale is logged as stopped and the
+scales already measured are kept
+"""
+
+from statistics import median
+import synthetic
+import subprocess
+import datetime
+import logging
+import json
+import csv
+import sys
+import time
+import os
+
+ENTRY_POINTS = ['inverted_index', 'indexer', 'query_processor', 'searcher',
+                'performance', 'search_server']
+HEAVY = ['numpy', 'nltk', 'matplotlib']
+HEADER = ['module', 'wall_ms', 'import_ms'] + [h+'_ms' for h in HEAVY]
+# regressions smaller than this are noise
+SLACK_MS = 20.
+# (module, entry function, cfg, what its throughput counts)
+STAGES = [('inverted_index', 'inverted_index_generator',
+           '/2-INVERTED_INDEX/iv.cfg', 'documents'),
+          ('indexer', 'indexer', '/3-INDEXER/ix.cfg', 'documents'),
+          ('query_processor', 'query_processor', '/4-QUERY_PROCESSOR/qp.cfg',
+           'queries'),
+          ('searcher', 'searcher', '/5-SEARCHER/se.cfg', 'queries'),
+          ('performance', 'performance_evaluator', '/6-PERFORMANCE/pe.cfg',
+           'queries')]
+SCALING_HEADER = ['commit', 'date', 'scale', 'documents', 'queries', 'stage',
+                  'wall_s', 'throughput', 'unit', 'peak_rss_mb']
+
+def benchmark(path, config_vector):
+    """
+runs the startup benchmark, and the scaling benchmark when ESCALAS= is given
+returns number of startup regressions found
+    """
+    begin = time.time()
+    global logger_global
+    log_path = path+'/7-BENCHMARK/bm.log'
+    log('benchmark', log_path)
+    logger_global = logging.getLogger('benchmark')
+    logger_global.info('Processing Benchmark Module...')
+
+    modules = ENTRY_POINTS
+    repetitions = 5
+    tolerance = 25.
+    outfile_startup = path+'/7-BENCHMARK/startup.csv'
+    reference = None
+    scales = []
+    corpus_dir = path+'/7-BENCHMARK/corpus'
+    outfile_scaling = path+'/7-BENCHMARK/scaling.csv'
+    n_queries = None
+    seed = 0
+    topk = None
+    for config in config_vector:
+        if str(config[0]) == 'MODULOS':
+            modules = [m.strip() for m in config[1].split(',') if m.strip()]
+        elif str(config[0]) == 'REPETICOES':
+            repetitions = int(config[1])
+        elif str(config[0]) == 'TOLERANCIA':
+            tolerance = float(config[1])
+        elif str(config[0]) == 'ESCREVA':
+            outfile_startup = path+config[1].strip()
+        elif str(config[0]) == 'REFERENCIA':
+            reference = path+config[1].strip()
+        elif str(config[0]) == 'ESCALAS':
+            scales = [float(scale) for scale in config[1].split(',')
+                      if scale.strip()]
+        elif str(config[0]) == 'CORPUS':
+            corpus_dir = path+config[1].strip()
+        elif str(config[0]) == 'ESCALA':
+            outfile_scaling = path+config[1].strip()
+        elif str(config[0]) == 'CONSULTAS':
+            n_queries = int(config[1])
+        elif str(config[0]) == 'SEMENTE':
+            seed = int(config[1])
+        elif str(config[0]) == 'TOPK':
+            topk = int(config[1])
+
+    rows = startup_benchmark(path, ['sys'] + modules, repetitions)
+    write_startup(outfile_startup, rows)
+    regressions = 0
+    if reference is not None:
+        regressions = compare_startup(read_startup(reference), rows,
+                                      tolerance)
+    if scales:
+        rows = scaling_benchmark(path, corpus_dir, scales, n_queries, seed,
+                                 topk)
+        write_scaling(outfile_scaling, rows)
+
+    end = time.time() - begin
+    logger_global.info('End of Benchmark Module. '
+                       'Total of %s elapsed.' % str(end))
+    return regressions
+
+
+
+def startup_benchmark(path, modules, repetitions=5):
+    """
+path: directory the modules are imported from
+modules: 'sys' (already loaded by the interpreter) measures the bare
+interpreter start
+returns array of dictionaries (see HEADER)
+    """
+    rows = []
+    for module in modules:
+        walls = []
+        for _ in range(repetitions):
+            wall, imports, loaded = import_once(path, module)
+            walls.append(wall)
+        row = {'module': module, 'wall_ms': median(walls),
+               'import_ms': imports.get(module, 0.)}
+        for heavy in HEAVY:
+            row[heavy+'_ms'] = imports.get(heavy, 0.) if heavy in loaded \
+                               else 0.
+        rows.append(row)
+        logger_global.info('%s: %.1f ms to start (median of %s), import '
+                           '%.1f ms, heavy: %s' %
+                           (module, row['wall_ms'], repetitions,
+                            row['import_ms'], ', '.join(loaded) or 'none'))
+    return rows
+
+
+
+def import_once(path, module):
+    """
+imports module in a fresh interpreter
+returns tuple: (wall time in ms, dictionary import ms per module name,
+                array of the HEAVY packages loaded)
+    """
+    code = ('import sys, json, %s; print(json.dumps([m for m in %r '
+            'if m in sys.modules]))' % (module, HEAVY))
+    init = time.perf_counter()
+    run = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                         cwd=path, capture_output=True, text=True)
+    wall = (time.perf_counter() - init) * 1000.
+    if run.returncode:
+        raise RuntimeError('importing %s failed:\n%s' % (module, run.stderr))
+    return wall, import_times(run.stderr), json.loads(run.stdout)
+
+
+
+def import_times(report):
+    """
+parses the -X importtime report
+returns dictionary: cumulative import ms per module name
+    """
+    imports = {}
+    for line in report.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imports[name.strip()] = int(cumulative) / 1000.
+    return imports
+
+
+
+def compare_startup(reference, rows, tolerance):
+    """
+logs the modules that start slower than in the reference
+returns number of regressions
+    """
+    regressions = 0
+    for row in rows:
+        try: before = reference[row['module']]
+        except KeyError: continue
+        limit = max(before * (1 + tolerance/100.), before + SLACK_MS)
+        if row['wall_ms'] > limit:
+            regressions += 1
+            logger_global.warning('REGRESSION %s: %.1f ms to start, was %.1f '
+                                  'ms' % (row['module'], row['wall_ms'],
+                                          before))
+        else:
+            logger_global.info('%s: %.1f ms to start, was %.1f ms' %
+                               (row['module'], row['wall_ms'], before))
+    return regressions
+
+
+
+def write_startup(filepath, rows):
+    """
+writes the benchmark in csv file
+    """
+    logger_global.info('Writing startup benchmark on file...')
+    with open(filepath, 'w', newline='') as csv_file:
+        csv_writer = csv.writer(csv_file, delimiter=';')
+        csv_writer.writerow(HEADER)
+        for row in rows:
+            csv_writer.writerow([row['module']] + ['%.1f' % row[column]
+                                                   for column in HEADER[1:]])
+
+
+
+def read_startup(filepath):
+    """
+returns dictionary: wall ms per module, from a csv written by write_startup
+    """
+    with open(filepath, 'r') as csv_file:
+        return {row['module']: float(row['wall_ms']) for row in
+                csv.DictReader(csv_file, delimiter=';')}
+
+
+
+def scaling_benchmark(path, corpus_dir, scales, n_queries=None, seed=0,
+                      topk=None):
+    """
+runs every stage of the pipeline on a synthetic collection per scale
+returns array of dictionaries (see SCALING_HEADER)
+    """
+    commit = commit_hash(path)
+    date = datetime.datetime.now().isoformat(timespec='seconds')
+    rows = []
+    for scale in scales:
+        workdir = '%s/x%g_s%s' % (corpus_dir, scale, seed)
+        collection = prepare_collection(path, workdir, scale, n_queries,
+                                        seed)
+        counts = {'documents': collection['n_documents'],
+                  'queries': collection['n_queries']}
+        for module, function, cfg, unit in STAGES:
+            inputs = collection['documents'] if module == 'inverted_index' \
+                     else [collection['queries']]
+            write_stage_cfg(path+cfg, workdir+cfg, workdir, inputs,
+                            topk if module == 'searcher' else None)
+            try:
+                wall, rss = run_stage(path, workdir, module, function, cfg)
+            except RuntimeError as error:
+                # the next stages need this one's output
+                logger_global.error('x%g stopped: %s' % (scale, error))
+                break
+            rows.append({'commit': commit, 'date': date, 'scale': scale,
+                         'documents': counts['documents'],
+                         'queries': counts['queries'], 'stage': module,
+                         'wall_s': wall, 'throughput': counts[unit] / wall,
+                         'unit': unit+'/s', 'peak_rss_mb': rss})
+            logger_global.info('x%g %s: %.2f s, %.1f %s/s, peak RSS %.1f MB'
+                               % (scale, module, wall, counts[unit] / wall,
+                                  unit, rss))
+    log_scaling(rows)
+    return rows
+
+
+
+def prepare_collection(path, workdir, scale, n_queries, seed):
+    """
+generates the synthetic collection of workdir, unless already there, and
+the stage directories
+returns dictionary: see synthetic.generate
+    """
+    stamp = workdir+'/1-DATA/collection.json'
+    if os.path.exists(stamp):
+        with open(stamp, 'r') as stamp_file:
+            collection = json.load(stamp_file)
+        if collection['n_queries'] == (n_queries or collection['n_queries']):
+            logger_global.info('Reusing synthetic collection x%g in %s' %
+                               (scale, workdir))
+            return collection
+    logger_global.info('Generating synthetic collection x%g in %s...' %
+                       (scale, workdir))
+    init = time.time()
+    collection = synthetic.generate(path, workdir, scale, n_queries, seed)
+    for _, _, cfg, _ in STAGES:
+        os.makedirs(os.path.dirname(workdir+cfg), exist_ok=True)
+    with open(stamp, 'w') as stamp_file:
+        json.dump(collection, stamp_file)
+    logger_global.info('%s documents and %s queries generated in %s s' %
+                       (collection['n_documents'], collection['n_queries'],
+                        str(time.time() - init)))
+    return collection
+
+
+
+def write_stage_cfg(source, target, workdir, inputs, topk=None):
+    """
+copies the stage's cfg, reading inputs (files in workdir) instead of the
+files of 1-DATA, and with topk as TOPK= when given
+    """
+    with open(source, 'r') as cfg:
+        lines = [line.strip() for line in cfg if line.strip()]
+    out = []
+    for line in lines:
+        if line.startswith('LEIA=/1-DATA/'):
+            # all inputs where the first file of 1-DATA was read
+            if inputs:
+                out += ['LEIA='+filepath[len(workdir):] for filepath in inputs]
+                inputs = []
+        elif not (topk is not None and line.startswith('TOPK=')):
+            out.append(line)
+    if topk is not None:
+        out.append('TOPK=%s' % topk)
+    with open(target, 'w', newline='') as cfg:
+        cfg.write('\r\n'.join(out))
+
+
+
+def run_stage(path, workdir, module, function, cfg):
+    """
+runs function of module on workdir in a new process, with the cfg of
+workdir (cwd path, so the modules of this repository are imported)
+returns tuple: (wall time in s, peak RSS in MB of the stage's process, pool
+workers not included)
+    """
+    code = ('import sys, %s\n'
+            'with open(sys.argv[1]+sys.argv[2]) as configuration:\n'
+            '    config_vector = [line.strip().split("=") '
+            'for line in configuration]\n'
+            '%s.%s(sys.argv[1], config_vector)' % (module, module, function))
+    with open(workdir+'/'+module+'.err', 'w') as err:
+        init = time.perf_counter()
+        process = subprocess.Popen([sys.executable, '-c', code, workdir, cfg],
+                                   cwd=path, stdout=err, stderr=err)
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - init
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode:
+        with open(workdir+'/'+module+'.err', 'r') as err:
+            raise RuntimeError('%s failed on %s:\n%s' %
+                               (module, workdir, err.read()[-2000:]))
+    # ru_maxrss is in KB on Linux
+    return wall, usage.ru_maxrss / 1024.
+
+
+
+def commit_hash(path):
+    """
+returns short hash of the checked out commit, '+' when there are
+uncommitted changes to tracked files ('unknown' outside git)
+    """
+    try:
+        head = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              cwd=path, capture_output=True, text=True,
+                              check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '-uno'],
+                               cwd=path, capture_output=True, text=True,
+                               check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return head + ('+' if dirty else '')
+
+
+
+def log_scaling(rows):
+    """
+logs how each stage's wall time grows against the collection, from the
+smallest scale (same growth: the stage scales linearly)
+    """
+    smallest = {}
+    for row in rows:
+        first = smallest.setdefault(row['stage'], row)
+        if first is not row:
+            logger_global.info('%s: %.2f times the wall time of x%g for a '
+                               '%.2f times larger collection (x%g)' %
+                               (row['stage'], row['wall_s'] / first['wall_s'],
+                                first['scale'], row['scale'] / first['scale'],
+                                row['scale']))
+
+
+
+def write_scaling(filepath, rows):
+    """
+appends the scaling benchmark to csv file (header when new), so runs of
+different commits can be compared
+    """
+    logger_global.info('Writing scaling benchmark on file...')
+    new = not os.path.exists(filepath)
+    with open(filepath, 'a', newline='') as csv_file:
+        csv_writer = csv.writer(csv_file, delimiter=';')
+        if new:
+            csv_writer.writerow(SCALING_HEADER)
+        for row in rows:
+            csv_writer.writerow([row['commit'], row['date'], '%g' %
+                                 row['scale'], row['documents'],
+                                 row['queries'], row['stage'],
+                                 '%.3f' % row['wall_s'],
+                                 '%.1f' % row['throughput'], row['unit'],
+                                 '%.1f' % row['peak_rss_mb']])
+
+
+
+def log(name, log_file):
+    """
+instantiates the logging
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    # create a file handler
+    handler = logging.FileHandler(log_file)
+    handler.setLevel(logging.INFO)
+    # create a logging format
+    formatter = logging.Formatter(
+                    '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    handler.setFormatter(formatter)
+    streamHandler = logging.StreamHandler()
+    streamHandler.setFormatter(formatter)
+    # add the handlers to the logger
+    logger.addHandler(handler)
+    logger.addHandler(streamHandler)
+
+
+
+if __name__ == '__main__':
+
+    PATH = os.path.dirname(os.path.abspath(__file__))
+
+    config_file = '/7-BENCHMARK/bm.cfg'
+
+    with open(PATH+config_file.strip(), 'r') as configuration:
+        config_vector=[]
+        for line in configuration:
+            line = line.strip()
+            config_vector.append(line.split('='))
+
+    sys.exit(1 if benchmark(PATH, config_vector) else 0)
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 13:05:12 2026
+@author: thabata
+
+binary on-disk format for the inverted index: two files side by side
+
+  <name>.lex - lexicon, memory-mapped when read
+    header       : magic 'IVLX', version, number of terms, number of docs
+    term offsets : (terms + 1) uint32, into the term strings
+    entries      : per term (postings offset uint64, postings bytes uint32,
+                   document frequency uint32), in term order
+    term strings : utf-8, sorted, so a term is found by binary search
+    doc offsets  : (docs + 1) uint32, into the doc key strings
+    doc keys     : utf-8, doc id = position of the key
+
+  <name>.pst - postings, per term (doc id gap, frequency) pairs as varints
+
+all integers are little-endian
+"""
+
+from array import array
+import mmap
+import struct
+
+MAGIC = b'IVLX'
+VERSION = 1
+HEADER = struct.Struct('<4sIII')
+ENTRY = struct.Struct('<QII')
+OFFSET = struct.Struct('<I')
+
+
+
+def postings_path(filepath):
+    """
+returns the path of the postings file that goes with a lexicon file
+    """
+    return filepath[:-len('.lex')]+'.pst'
+
+
+
+def encode_postings(postings):
+    """
+delta + varint encodes array of interleaved (doc id, frequency) pairs
+doc ids must be increasing
+returns bytes
+    """
+    out = bytearray()
+    last = 0
+    for i in range(0, len(postings), 2):
+        doc_id = postings[i]
+        for value in (doc_id - last, postings[i+1]):
+            while value > 0x7f:
+                out.append((value & 0x7f) | 0x80)
+                value >>= 7
+            out.append(value)
+        last = doc_id
+    return bytes(out)
+
+
+
+def decode_postings(buf):
+    """
+decodes what encode_postings wrote
+returns array('I') of interleaved (doc id, frequency) pairs
+    """
+    postings = array('I')
+    value = shift = 0
+    last = 0
+    first = True
+    for byte in buf:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        if first:
+            last += value
+            postings.append(last)
+        else:
+            postings.append(value)
+        first = not first
+        value = shift = 0
+    return postings
+
+
+
+def write_index(filepath, items, docs_keys):
+    """
+writes the binary inverted index (filepath is the .lex file)
+items: iterable of (token, postings) in any order; postings are written as
+they arrive and only the lexicon entries are kept to be sorted at the end
+    """
+    entries = []
+    offset = 0
+    with open(postings_path(filepath), 'wb') as pst_file:
+        for token, postings in items:
+            buf = encode_postings(postings)
+            pst_file.write(buf)
+            entries.append((token.encode('utf-8'), offset, len(buf),
+                            len(postings)//2))
+            offset += len(buf)
+    entries.sort()
+
+    docs_blob = [key.encode('utf-8') for key in docs_keys]
+    with open(filepath, 'wb') as lex_file:
+        lex_file.write(HEADER.pack(MAGIC, VERSION,
+                                   len(entries), len(docs_keys)))
+        lex_file.write(offsets_table([entry[0] for entry in entries]))
+        for _, pst_offset, pst_len, df in entries:
+            lex_file.write(ENTRY.pack(pst_offset, pst_len, df))
+        for entry in entries:
+            lex_file.write(entry[0])
+        lex_file.write(offsets_table(docs_blob))
+        for key in docs_blob:
+            lex_file.write(key)
+
+
+
+def offsets_table(strings):
+    """
+returns bytes: (len(strings) + 1) uint32 offsets of the concatenated strings
+    """
+    offsets = array('I', [0])
+    for s in strings:
+        offsets.append(offsets[-1] + len(s))
+    if array('I', [1]).tobytes()[0] != 1:
+        offsets.byteswap()
+    return offsets.tobytes()
+
+
+
+class Lexicon:
+    """
+read-only view of a binary inverted index
+the lexicon is memory-mapped and searched in place; the postings of one
+term are read from the .pst file only when asked for
+    """
+
+    def __init__(self, filepath):
+        with open(filepath, 'rb') as lex_file:
+            self.lex = mmap.mmap(lex_file.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(postings_path(filepath), 'rb') as pst_file:
+            if pst_file.seek(0, 2):
+                self.pst = mmap.mmap(pst_file.fileno(), 0,
+                                     access=mmap.ACCESS_READ)
+            else:
+                self.pst = b''
+
+        magic, version, self.n_terms, self.n_docs = \
+                                    HEADER.unpack_from(self.lex, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(filepath+' is not a binary inverted index')
+
+        self.term_offsets = HEADER.size
+        self.entries = self.term_offsets + OFFSET.size*(self.n_terms+1)
+        self.terms_blob = self.entries + ENTRY.size*self.n_terms
+        self.doc_offsets = self.terms_blob + self.offset(self.term_offsets,
+                                                         self.n_terms)
+        self.docs_blob = self.doc_offsets + OFFSET.size*(self.n_docs+1)
+
+
+    def __len__(self):
+        return self.n_terms
+
+
+    def __contains__(self, token):
+        return self.find(token) >= 0
+
+
+    def offset(self, table, i):
+        return OFFSET.unpack_from(self.lex, table + OFFSET.size*i)[0]
+
+
+    def term_bytes(self, i):
+        start = self.terms_blob + self.offset(self.term_offsets, i)
+        end = self.terms_blob + self.offset(self.term_offsets, i+1)
+        return self.lex[start:end]
+
+
+    def term(self, i):
+        return self.term_bytes(i).decode('utf-8')
+
+
+    def find(self, token):
+        """
+binary search on the sorted terms
+returns term number or -1
+        """
+        target = token.encode('utf-8')
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.term_bytes(mid) < target: lo = mid + 1
+            else: hi = mid
+        if lo < self.n_terms and self.term_bytes(lo) == target:
+            return lo
+        return -1
+
+
+    def entry(self, i):
+        """
+returns tuple: (postings offset, postings bytes, document frequency)
+        """
+        return ENTRY.unpack_from(self.lex, self.entries + ENTRY.size*i)
+
+
+    def postings_at(self, i):
+        offset, length, _ = self.entry(i)
+        return decode_postings(self.pst[offset:offset+length])
+
+
+    def postings(self, token):
+        """
+returns array('I') of (doc id, frequency) pairs, empty if token is unknown
+        """
+        i = self.find(token)
+        return self.postings_at(i) if i >= 0 else array('I')
+
+
+    def df(self, token):
+        i = self.find(token)
+        return self.entry(i)[2] if i >= 0 else 0
+
+
+    def items(self):
+        """
+yields (token, postings) in sorted token order
+        """
+        for i in range(self.n_terms):
+            yield self.term(i), self.postings_at(i)
+
+
+    def docs_keys(self):
+        """
+returns array of document keys (doc id = position)
+        """
+        keys = []
+        for i in range(self.n_docs):
+            start = self.docs_blob + self.offset(self.doc_offsets, i)
+            end = self.docs_blob + self.offset(self.doc_offsets, i+1)
+            keys.append(self.lex[start:end].decode('utf-8'))
+        return keys
+
+
+    def close(self):
+        self.lex.close()
+        if self.pst:
+            self.pst.close()
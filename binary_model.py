@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 16:10:05 2026
+@author: thabata
+
+binary on-disk format for the TF*IDF model, read in place (memory-mapped)
+
+  header    : magic 'TFMD', version, generation, number of docs, number of
+              terms, number of sections
+  directory : per section (name, numpy dtype, offset, count)
+  sections  : flat arrays, each aligned to 8 bytes
+    indptr  : (docs + 1) int64, row i = entries indptr[i]:indptr[i+1]
+    indices : int32 term id of each entry
+    data    : float64 TF*IDF weight of each entry
+    norms   : float64 euclidean norm of each document
+    termptr, termstr : offsets + utf-8 of the terms, sorted (term id = rank)
+    docptr, docstr   : offsets + utf-8 of the document keys
+    postptr : (terms + 1) int64, postings of term t = postptr[t]:postptr[t+1]
+    postings: int64 entry numbers (into indices/data) of each term, in
+              document order, for term-at-a-time scoring
+    bounds  : float64 per term, max over its documents of weight / norm,
+              the largest cosine contribution of the term (MaxScore)
+    rows    : int32 document (row) number of each entry, so that scoring
+              processes map it from the file instead of each building it
+    index   : (optional) ascii identity of the segments index the model
+              was built from (see segments)
+
+readers look sections up by name, so new sections can be added without
+breaking older readers; all integers are little-endian
+"""
+
+from collections import OrderedDict
+from multiprocessing import shared_memory
+import numpy as np
+import mmap
+import struct
+import io
+import os
+
+MAGIC = b'TFMD'
+VERSION = 1
+HEADER = struct.Struct('<4sIQIII')
+SECTION = struct.Struct('<8s4sQQ')
+ALIGN = 8
+# tokens whose term id is memoized per model (cleared when full)
+TERM_CACHE = 100000
+
+
+
+def strings_table(strings):
+    """
+returns tuple: (int64 offsets array, uint8 array of the concatenated utf-8)
+    """
+    blobs = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(blobs)+1, dtype=np.int64)
+    np.cumsum([len(b) for b in blobs], out=offsets[1:])
+    return offsets, np.frombuffer(b''.join(blobs), dtype=np.uint8)
+
+
+
+def pack_model(out, docs, terms, indptr, indices, data, norms,
+               generation=0, extra=()):
+    """
+writes the model to a binary file object
+terms are sorted on the way, and indices renumbered to match
+extra: (name, array) sections written after the standard ones
+    """
+    order = sorted(range(len(terms)), key=lambda i: terms[i].encode('utf-8'))
+    rank = np.empty(len(terms), dtype=np.int32)
+    rank[order] = np.arange(len(terms), dtype=np.int32)
+    termptr, termstr = strings_table([terms[i] for i in order])
+    docptr, docstr = strings_table(docs)
+    indices = rank[np.asarray(indices, dtype=np.int64)]
+    postptr = np.zeros(len(terms)+1, dtype=np.int64)
+    np.cumsum(np.bincount(indices, minlength=len(terms)), out=postptr[1:])
+    postings = np.argsort(indices, kind='stable')
+    norms = np.asarray(norms, dtype=np.float64)
+    rows = np.repeat(np.arange(len(docs)), np.diff(indptr))
+    ratio = np.divide(data, norms[rows], out=np.zeros(len(rows)),
+                      where=norms[rows] != 0)
+    bounds = np.zeros(len(terms))
+    np.maximum.at(bounds, indices, ratio)
+
+    sections = [('indptr', np.asarray(indptr, dtype='<i8')),
+                ('indices', indices.astype('<i4')),
+                ('data', np.asarray(data, dtype='<f8')),
+                ('norms', np.asarray(norms, dtype='<f8')),
+                ('termptr', termptr.astype('<i8')),
+                ('termstr', termstr),
+                ('docptr', docptr.astype('<i8')),
+                ('docstr', docstr),
+                ('postptr', postptr.astype('<i8')),
+                ('postings', postings.astype('<i8')),
+                ('bounds', bounds.astype('<f8')),
+                ('rows', rows.astype('<i4'))]
+    sections += list(extra)
+
+    offset = HEADER.size + SECTION.size*len(sections)
+    directory = []
+    for name, values in sections:
+        offset += -offset % ALIGN
+        directory.append(SECTION.pack(name.encode('ascii'),
+                                      values.dtype.str.encode('ascii'),
+                                      offset, len(values)))
+        offset += values.nbytes
+
+    out.write(HEADER.pack(MAGIC, VERSION, generation,
+                          len(docs), len(terms), len(sections)))
+    for entry in directory:
+        out.write(entry)
+    position = HEADER.size + SECTION.size*len(sections)
+    for _, values in sections:
+        out.write(b'\0' * (-position % ALIGN))
+        position += -position % ALIGN
+        out.write(values.tobytes())
+        position += values.nbytes
+
+
+
+def write_model(filepath, docs, terms, indptr, indices, data, norms,
+                generation=0, extra=()):
+    """
+writes the binary model file (see pack_model) atomically (temporary file
+in the same directory + rename): a reader mapping filepath meanwhile gets
+either the old model or the new one, never a partial file
+    """
+    with open(filepath+'.tmp', 'wb') as model_file:
+        pack_model(model_file, docs, terms, indptr, indices, data, norms,
+                   generation, extra)
+    os.replace(filepath+'.tmp', filepath)
+
+
+
+def load_model(filepath):
+    """
+memory-maps a binary model file: nothing is parsed or copied, pages are
+read on demand and shared (page cache) with other processes
+returns Model
+    """
+    with open(filepath, 'rb') as model_file:
+        buffer = mmap.mmap(model_file.fileno(), 0, access=mmap.ACCESS_READ)
+    model = Model(buffer)
+    model.filepath = filepath
+    return model
+
+
+
+def model_generation(filepath):
+    """
+reads only the header of a binary model file
+returns its generation, None when there is no such model file
+    """
+    try:
+        with open(filepath, 'rb') as model_file:
+            magic, _, generation, _, _, _ = HEADER.unpack(
+                                        model_file.read(HEADER.size))
+    except (FileNotFoundError, struct.error):
+        return None
+    return generation if magic == MAGIC else None
+
+
+
+def model_index(filepath):
+    """
+returns the identity of the segments index a binary model file was built
+from, None when there is no such model file or section
+    """
+    try:
+        index = load_model(filepath).section('index')
+    except (FileNotFoundError, ValueError, struct.error):
+        return None
+    return None if index is None else index.tobytes().decode('ascii')
+
+
+
+def share_model(model):
+    """
+makes a model reachable from other processes without pickling its arrays:
+a memory-mapped model is just mapped again from its file, any other model
+is copied once into shared memory
+returns tuple: (handle for attach_model, SharedMemory to unlink or None)
+    """
+    if model.filepath:
+        return ('file', model.filepath), None
+    shm = shared_memory.SharedMemory(create=True, size=len(model.buffer))
+    shm.buf[:len(model.buffer)] = model.buffer
+    return ('shm', shm.name), shm
+
+
+
+def attach_model(handle):
+    """
+opens a model shared by share_model (e.g. inside a pool worker)
+returns Model
+    """
+    kind, name = handle
+    if kind == 'file':
+        return load_model(name)
+    # pool workers share the owner's resource tracker, and only the owner
+    # unlinks the block
+    shm = shared_memory.SharedMemory(name=name)
+    model = Model(shm.buf)
+    model.shm = shm
+    return model
+
+
+
+def from_arrays(docs, terms, indptr, indices, data, norms, generation=0):
+    """
+builds an in-memory Model from arrays (e.g. a model read from csv)
+returns Model
+    """
+    out = io.BytesIO()
+    pack_model(out, docs, terms, indptr, indices, data, norms, generation)
+    return Model(out.getvalue())
+
+
+
+class Model:
+    """
+read-only TF*IDF model over a buffer in the binary model format (mmap,
+bytes or shared memory); sections are numpy arrays viewing the buffer
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.filepath = None
+        magic, version, self.generation, self.n_docs, self.n_terms, \
+            n_sections = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('buffer is not a binary TF*IDF model')
+
+        self.sections = OrderedDict()
+        for i in range(n_sections):
+            name, dtype, offset, count = \
+                SECTION.unpack_from(buffer, HEADER.size + SECTION.size*i)
+            dtype = dtype.rstrip(b'\0').decode('ascii')
+            self.sections[name.rstrip(b'\0').decode('ascii')] = \
+                np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+
+        self.indptr = self.sections['indptr']
+        self.indices = self.sections['indices']
+        self.data = self.sections['data']
+        self.norms = self.sections['norms']
+        self.termptr = self.sections['termptr']
+        self.termstr = self.sections['termstr']
+        self.postptr = self.sections['postptr']
+        self.postings = self.sections['postings']
+        self.bounds = self.sections['bounds']
+        self._rows = None
+        self._docs_keys = None
+        self._term_ids = {}
+
+
+    def section(self, name):
+        """
+returns array, or None if the model has no such section
+        """
+        return self.sections.get(name)
+
+
+    def term_bytes(self, i):
+        return self.termstr[self.termptr[i]:self.termptr[i+1]].tobytes()
+
+
+    def term(self, i):
+        return self.term_bytes(i).decode('utf-8')
+
+
+    def term_id(self, token):
+        """
+binary search on the sorted terms, memoized in a bounded cache (a
+long-running server sees unbounded distinct tokens)
+returns term id or -1
+        """
+        try: return self._term_ids[token]
+        except KeyError: pass
+        if len(self._term_ids) >= TERM_CACHE:
+            self._term_ids.clear()
+        self._term_ids[token] = term_id = self.find(token)
+        return term_id
+
+
+    def find(self, token):
+        target = token.encode('utf-8')
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.term_bytes(mid) < target: lo = mid + 1
+            else: hi = mid
+        if lo < self.n_terms and self.term_bytes(lo) == target:
+            return lo
+        return -1
+
+
+    def rows(self):
+        """
+returns array: document (row) number of each entry, the rows section
+(built once for models written without it)
+        """
+        if self._rows is None:
+            self._rows = self.sections.get('rows')
+        if self._rows is None:
+            self._rows = np.repeat(np.arange(self.n_docs, dtype=np.int32),
+                                   np.diff(self.indptr))
+        return self._rows
+
+
+    def doc_keys(self, docs):
+        """
+docs: row numbers
+returns array of their document keys, decoded from the string table (only
+these: e.g. the top k of a ranking)
+        """
+        docptr = self.sections['docptr']
+        docstr = self.sections['docstr']
+        return [docstr[docptr[i]:docptr[i+1]].tobytes().decode('utf-8')
+                for i in docs]
+
+
+    def docs_keys(self):
+        """
+returns array of every document key (row number = position), decoded once
+        """
+        if self._docs_keys is None:
+            docptr = self.sections['docptr'].tolist()
+            docstr = self.sections['docstr'].tobytes()
+            self._docs_keys = [docstr[docptr[i]:docptr[i+1]].decode('utf-8')
+                               for i in range(self.n_docs)]
+        return self._docs_keys
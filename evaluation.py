@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 20:31:06 2026
+@author: thabata
+
+vectorized evaluation of a run against the expected results: precision and
+recall at every rank, interpolated precision, eleven-point curve, P@k, MAP,
+R-precision and nDCG
+
+each query's judgments are sorted once and the ranking is matched against
+them with one binary search (np.searchsorted); every measure is then a
+cumulative sum over the matches, in rank order, so the values are the same
+floats the former nested loops produced:
+- an answer listed twice counts twice (precision, recall and gains)
+- recall is relative to the number of answers listed
+- gain of an answer: sum of the digits of its score (e.g. '1222' -> 7),
+  discounted by 1/rank
+"""
+
+import numpy as np
+
+# recall levels of the eleven-point curve, besides 0 and 1
+LEVELS = [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9]
+CUTOFFS = (5, 10)
+
+
+
+def doc_numbers(keys, memo):
+    """
+keys: document keys as written in the results ('00048 ')
+memo: dictionary of keys already converted, shared over the run
+returns int64 array of document numbers
+    """
+    numbers = []
+    for key in keys:
+        try: numbers.append(memo[key])
+        except KeyError:
+            memo[key] = int(key.strip())
+            numbers.append(memo[key])
+    return np.array(numbers, dtype=np.int64)
+
+
+
+def judgments(answer):
+    """
+answer: array of answer tuples (docnum, score)
+returns tuple: (sorted document numbers, their gains, in answer order among
+equal documents)
+    """
+    docs = np.array([int(doc.strip()) for doc, _ in answer], dtype=np.int64)
+    gains = np.array([sum(int(r) for r in score.strip())
+                      for _, score in answer], dtype=np.int64)
+    order = np.argsort(docs, kind='stable')
+    return docs[order], gains[order]
+
+
+
+class QueryEvaluation:
+    """
+measures of one query
+found: relevant documents up to each rank
+precision, recall: float arrays, one value per rank
+dcg, ndcg: float arrays, one value per relevant document found (rank order)
+    """
+
+    def __init__(self, answer, ranks, docs):
+        answer_docs, gains = judgments(answer)
+        self.n_answers = len(answer)
+        self.n_results = len(docs)
+
+        # matches of each ranked document: answers left:right
+        left = np.searchsorted(answer_docs, docs, 'left')
+        right = np.searchsorted(answer_docs, docs, 'right')
+        matches = right - left
+        found = np.cumsum(matches)
+        positions = np.arange(1, len(docs)+1)
+        self.found = found
+        self.precision = found / positions
+        self.recall = found / self.n_answers
+        self.relevant = matches
+
+        # one gain per (rank, matching answer), rank order then answer order
+        matched = np.flatnonzero(matches)
+        events = np.repeat(matched, matches[matched])
+        offsets = np.arange(len(events)) - \
+                  np.repeat(np.cumsum(matches[matched]) - matches[matched],
+                            matches[matched])
+        event_gains = gains[left[events] + offsets]
+        self.dcg = np.cumsum(event_gains / ranks[events])
+        ideal = np.sort(event_gains)[::-1]
+        idcg = np.cumsum(ideal / np.arange(1, len(ideal)+1))
+        self.ndcg = self.dcg / idcg
+
+
+    def interpolated(self):
+        """
+keeps the (precision, recall) points not dominated by a higher precision
+further down the ranking (the interpolated precision-recall curve, recall
+domain intact)
+returns array of tuples (precision, recall)
+        """
+        if not self.n_results:
+            return []
+        precision = self.precision
+        later = np.empty(len(precision))
+        later[-1] = -np.inf
+        later[:-1] = np.maximum.accumulate(precision[::-1])[::-1][1:]
+        keep = precision >= later
+        return list(zip(precision[keep].tolist(), self.recall[keep].tolist()))
+
+
+    def eleven_point(self):
+        """
+interpolated precision at recall 0, 0.1, ..., 0.9 and 1: the first point
+of the interpolated curve reaching each level (the last point when the
+level isn't reached); recall 1 always takes the last point
+no results: precision 0 at every level
+returns array of precisions
+        """
+        curve = self.interpolated()
+        if not curve:
+            return [0.] * 11
+        precision = [p for p, _ in curve]
+        recall = np.array([r for _, r in curve])
+        at = np.minimum(np.searchsorted(recall, LEVELS, 'left'),
+                        len(curve) - 1)
+        return [precision[0]] + [precision[i] for i in at] + [precision[-1]]
+
+
+    def precision_at(self, k):
+        """
+relevant documents in the first k ranks / k (a shorter ranking counts the
+missing ranks as not relevant)
+        """
+        if not self.n_results or not k:
+            return 0.
+        return int(self.found[min(k, self.n_results) - 1]) / k
+
+
+    def r_precision(self):
+        return self.precision_at(self.n_answers)
+
+
+    def average_precision(self):
+        """
+mean over the answers of the precision at the rank each one is found
+(answers never found count 0)
+        """
+        return float(np.sum(self.precision * self.relevant) / self.n_answers)
+
+
+    def final_ndcg(self):
+        """
+nDCG at the last relevant document found, 0 when none is found
+        """
+        return float(self.ndcg[-1]) if len(self.ndcg) else 0.
+
+
+
+def evaluate(answers, results):
+    """
+answers[query key] = array of answer tuples (docnum, score)
+results[query key] = array of results tuples (rank, docnum, sim)
+returns dictionary: evaluation[query key] = QueryEvaluation
+    """
+    memo = {}
+    evaluation = {}
+    for query_key, result in results.items():
+        ranks = np.array([item[0] for item in result], dtype=np.int64)
+        docs = doc_numbers([item[1] for item in result], memo)
+        evaluation[query_key] = QueryEvaluation(answers[query_key], ranks,
+                                                docs)
+    return evaluation
+
+
+
+def eleven_point_curve(evaluation):
+    """
+averages the eleven-point interpolated precision over all queries
+returns array of tuples (precision, recall)
+    """
+    points = [query.eleven_point() for query in evaluation.values()]
+    curve = []
+    for i in range(11):
+        precision = [point[i] for point in points]
+        curve.append((sum(precision) / len(precision), float(i)/10.))
+    return curve
+
+
+
+def per_query(evaluation, keys=None):
+    """
+keys: queries to take, in this order (default: all, in evaluation order)
+returns tuple: (array of measure names: P@k for each of CUTOFFS,
+R-precision, MAP and nDCG; float array queries x measures, MAP column being
+each query's average precision)
+    """
+    queries = [evaluation[key] for key in
+               (evaluation.keys() if keys is None else keys)]
+    names = ['P@%s' % k for k in CUTOFFS] + ['R-precision', 'MAP', 'nDCG']
+    table = np.empty((len(queries), len(names)))
+    for i, q in enumerate(queries):
+        table[i] = [q.precision_at(k) for k in CUTOFFS] + \
+                   [q.r_precision(), q.average_precision(), q.final_ndcg()]
+    return names, table
+
+
+
+def summary(evaluation):
+    """
+returns dictionary of the run's mean measures: P@k for each of CUTOFFS,
+R-precision, MAP and nDCG
+    """
+    names, table = per_query(evaluation)
+    return {name: float(np.mean(np.ascontiguousarray(table[:, j])))
+            for j, name in enumerate(names)}
@@ -6,8 +6,16 @@ Created on Sat Aug 25 14:54:15 2018
 """
 import csv
 from math import log10
-from nltk.probability import FreqDist
+from collections import Counter, namedtuple
+from array import array
+import numpy as np
+import binary_index
+import binary_model
+import metrics
+import profiler
+import segments
 import logging
+import os
 import time
 
 def indexer(path, config_vector):
@@ -20,27 +28,77 @@ calls functions to read inverted index and creates TF.IDF matrix
     log('indexer', log_path)
     logger_global = logging.getLogger('indexer')
     logger_global.info('Processing Indexer Module...')
+    profiler.configure(log_path, config_vector)
 
-    outfile_indexer = 0
+    outfiles_indexer = []
+    stats = None
+    shards = 1
+    seg_dir = None
     for config in config_vector:
-        if str(config[0]) == 'LEIA':            
-            inv_ix = read_CSV(path+config[1].strip())
+        if str(config[0]) == 'LEIA':
+            # segments are read once the outfiles are known (see below)
+            if os.path.isdir(path+config[1].strip()):
+                seg_dir = path+config[1].strip()
+                continue
+            with profiler.stage('load'):
+                if config[1].strip().endswith('.lex'):
+                    docs_keys, inv_ix = read_binary(path+config[1].strip())
+                else:
+                    docs_keys, inv_ix = read_CSV(path+config[1].strip())
             
         elif str(config[0]) == 'ESCREVA':
-            outfile_indexer = path+config[1]
+            outfiles_indexer.append(path+config[1])
+            
+        elif str(config[0]) == 'FRAGMENTOS':
+            shards = int(config[1])
     
-    if not outfile_indexer:
-        outfile_indexer = path+'/3-INDEXER/indexer_out.csv'
+    if not outfiles_indexer:
+        outfiles_indexer = [path+'/3-INDEXER/indexer_out.csv']
         logger_global.warning('Log file for Indexer not specified. '
-                             'Applying default: '+outfile_indexer)
+                             'Applying default: '+outfiles_indexer[0])
+
+    if seg_dir is not None:
+        manifest = segments.load_manifest(seg_dir)
+        generation = manifest['generation']
+        if model_current(outfiles_indexer, shards, generation,
+                         manifest['index']):
+            logger_global.info('Model already at index generation %s: '
+                               'nothing to rebuild' % generation)
+            logger_global.info('End of Inverted Index Generator Module. '
+                               'Total of %s elapsed.' %
+                               str(time.time() - begin))
+            return
+        with profiler.stage('load'):
+            docs_keys, inv_ix, stats = read_segments(seg_dir)
 
     end = time.time() - begin
+    metrics.observe('load', end)
     logger_global.info('Inverted index read succesfully '
                       'in %s s' % str(end))
 
-    write_tfidf(outfile_indexer, inv_ix, *TFIDF(inv_ix))
+    with profiler.stage('tfidf'):
+        tfidf = TFIDF(inv_ix, docs_keys, stats)
+    for outfile_indexer in outfiles_indexer:
+        with profiler.stage('write'):
+            if outfile_indexer.endswith('.mdl') and shards > 1:
+                write_shards(outfile_indexer, tfidf, shards,
+                             stats['generation'] if stats else 0,
+                             stats['index'] if stats else None)
+            elif outfile_indexer.endswith('.mdl'):
+                write_model(outfile_indexer, tfidf,
+                            stats['generation'] if stats else 0,
+                            index=stats['index'] if stats else None)
+            else:
+                write_tfidf(outfile_indexer, tfidf)
 
     end = time.time() - begin
+    metrics.count('documents', len(docs_keys))
+    metrics.count('terms', len(inv_ix))
+    metrics.observe('run', end)
+    metrics.export(metrics.metrics_path(path, log_path, config_vector),
+                   {'module': 'indexer'})
+    for filepath in profiler.finish():
+        logger_global.info('Profile written on '+filepath)
     logger_global.info('End of Inverted Index Generator Module. '
                    'Total of %s elapsed.' % str(end))
 
@@ -49,18 +107,87 @@ calls functions to read inverted index and creates TF.IDF matrix
 def read_CSV(filename):
     """
 reads inverted index from csv file
-returns dictionary: inv_ix[token] = array of documents containing token
+returns tuple: (array of document keys, dictionary of postings)
+inv_ix[token] = array('I') of interleaved (doc id, frequency) pairs
+doc id = position of the document key in the keys array
     """
     import ast
     logger_global.info('Reading '+filename+' file...')
+    docs_keys = []
+    docs_ids = {}
     inv_ix = {}
     
+    # a row holds a whole posting list: past the default field limit
+    # (128 KiB) on large collections
+    csv.field_size_limit(2**31 - 1)
     with open(filename,"r") as csv_file:
         csv_reader = csv.reader(csv_file, delimiter=';')
         for row in csv_reader:
-            inv_ix[row[0]] = ast.literal_eval(row[1])
+            postings = array('I')
+            for key, freq in Counter(ast.literal_eval(row[1])).items():
+                try: doc_id = docs_ids[key]
+                except KeyError:
+                    doc_id = docs_ids[key] = len(docs_keys)
+                    docs_keys.append(key)
+                postings.append(doc_id)
+                postings.append(freq)
+            inv_ix[row[0]] = postings
+    
+    return docs_keys, inv_ix
+
+
+
+def read_binary(filename):
+    """
+reads inverted index from binary files (.lex and .pst, see binary_index)
+returns tuple: (array of document keys, dictionary of postings)
+inv_ix[token] = array('I') of interleaved (doc id, frequency) pairs
+    """
+    logger_global.info('Reading '+filename+' file...')
+    lexicon = binary_index.Lexicon(filename)
+    docs_keys = lexicon.docs_keys()
+    inv_ix = dict(lexicon.items())
+    lexicon.close()
     
-    return inv_ix
+    return docs_keys, inv_ix
+
+
+
+def read_segments(dirname):
+    """
+reads every segment of an incremental index (see segments) as one index;
+the whole model is rebuilt from them, as any new segment changes the IDF
+and norms of the documents of the others
+returns tuple: (array of document keys, dictionary of postings, stats)
+stats: collection statistics kept up to date by the segments manifest
+    """
+    logger_global.info('Reading segments from '+dirname+'...')
+    docs_keys, inv_ix, stats = segments.read_segments(dirname)
+    logger_global.info('Index generation %s: %s documents, %s tokens' %
+                       (stats['generation'], len(docs_keys), len(inv_ix)))
+    
+    return docs_keys, inv_ix, stats
+
+
+
+def model_current(outfiles, shards, generation, index):
+    """
+True when every outfile is a binary model (first shard when sharded)
+already built from this generation of these segments (same index identity,
+see segments; csv outfiles carry neither: always rebuilt)
+    """
+    if not generation:
+        return False
+    for outfile in outfiles:
+        outfile = outfile.strip()
+        if not outfile.endswith('.mdl'):
+            return False
+        if shards > 1:
+            outfile = shard_path(outfile, 0)
+        if binary_model.model_generation(outfile) != generation or \
+           binary_model.model_index(outfile) != index:
+            return False
+    return True
 
 
 
@@ -85,104 +212,188 @@ instantiates the logging
 
 
 
-def get_doc_list(inv_ix):
-    """
-get document keys list from inverted index
-returns array
-    """
-    doc_list = []
-    for _, partial_list in inv_ix.items():
-        doc_list += partial_list
-    doc_list = list(set(doc_list))
-    return doc_list
+TfidfMatrix = namedtuple('TfidfMatrix', 'data indices indptr terms docs')
+TfidfMatrix.__doc__ = """
+docs x terms TF*IDF sparse matrix in CSR layout (as scipy.sparse.csr_matrix)
+row i is document docs[i]: its weights are data[indptr[i]:indptr[i+1]] for
+the term ids indices[indptr[i]:indptr[i+1]]; terms[term id] = token
+"""
 
 
 
-def TFIDF(inv_ix):
+def TFIDF(inv_ix, docs_keys, stats=None):
     """
-calculates TF*IDF for documents and outsources definition of document list
-returns nested dictionaries: tfidf[token][document key]
-returns array of documents keys
+calculates TF*IDF for all postings at once, as a docs x terms CSR matrix
+stats (optional): collection statistics maintained incrementally
+    (n_docs, maxf, df) used instead of recomputing them from inv_ix
+returns TfidfMatrix
     """
     init = time.time()
     logger_global.info('Calculating TF*IDF...')
     
-    doc_list = get_doc_list(inv_ix)
+    terms = list(inv_ix.keys())
+    postings = [inv_ix[token] for token in terms]
+    df = np.fromiter((len(p)//2 for p in postings), np.int64, len(terms))
+    pairs = np.frombuffer(b''.join(p.tobytes() for p in postings),
+                          dtype=np.uint32).reshape(-1, 2)
+    doc_ids = pairs[:, 0]
+    term_ids = np.repeat(np.arange(len(terms)), df)
+    
+    # term-major postings -> doc-major rows; the stable sort keeps the terms
+    # of each row in inverted index order
+    order = np.argsort(doc_ids, kind='stable')
+    indptr = np.zeros(len(docs_keys)+1, dtype=np.int64)
+    np.cumsum(np.bincount(doc_ids, minlength=len(docs_keys)), out=indptr[1:])
+    indices = term_ids[order]
+    freqs = pairs[order, 1]
     
-    idf = IDF(inv_ix, len(doc_list))
-    tf = TF(inv_ix)
-    tfidf = {}
-    for token, keys in tf.items():
-        tfidf[token] = {}
-        for key in keys:
-            tfidf[token][key] = tf[token][key] * idf[token]
+    if stats is None:
+        n_docs = int(np.count_nonzero(np.diff(indptr)))
+        maxf = int(freqs.max()) if len(freqs) else 1
+    else:
+        n_docs, maxf = stats['n_docs'], stats['maxf']
+        df = np.array([stats['df'][token] for token in terms], dtype=np.int64)
+    
+    data = TF(freqs, maxf) * IDF(df, n_docs)[indices]
 
     end = time.time() - init
+    metrics.observe('tfidf', end)
     logger_global.info('Indexer operation finished in %s s' % str(end))
     
-    return tfidf, doc_list
+    return TfidfMatrix(data, indices, indptr, terms, docs_keys)
 
 
 
-def TF(inv_ix):
+def TF(freqs, maxf):
     """
-calculates TF for documents and tokens
-returns nested dictionary: tf[token][document key]
-TF(term,doc) = frequency of term in doc / total terms in doc
+calculates TF for an array of (term, doc) frequencies
+returns array
+TF(term,doc) = frequency of term in doc / maximum frequency in the collection
     """
-    tf = {}
-    maxf = 0
-    for token, list_keys in inv_ix.items():
-        tf[token] = {}
-        for key in list_keys:
-            tf[token][key] = inv_ix[token].count(key)
-            maxf = tf[token][key] if tf[token][key] > maxf else maxf
-    
-    for token, _ in tf.items():
-        for key, _ in tf[token].items():
-            tf[token][key] /= maxf
-    return tf
+    return freqs / maxf
 
 
 
-def IDF(inv_ix, how_many_docs):
+def IDF(df, how_many_docs):
     """
-calculates IDF for tokens in inverted index
-returns dictionary: idf[token] = value
+calculates IDF for an array of document frequencies (one per term)
+returns array
 IDF(term) = log(number of docs / number of docs with the term)
     """
-    idf = {}
-    for token, list_keys in inv_ix.items():
-        idf[token] = log10(how_many_docs/len(set(list_keys)))
-    
-    return idf
+    # math.log10 per term (not np.log10) keeps the values bit-identical
+    return np.array([log10(how_many_docs/d) for d in df.tolist()],
+                    dtype=np.float64)
 
 
 
-def write_tfidf(filepath, inv_ix, tfidf, doc_list):
+def doc_norms(tfidf):
     """
-write tfidf in csv file
+calculates the euclidean norm of each document row of a TfidfMatrix
+returns array
+    """
+    rows = np.repeat(np.arange(len(tfidf.docs)), np.diff(tfidf.indptr))
+    return np.sqrt(np.bincount(rows, weights=tfidf.data*tfidf.data,
+                               minlength=len(tfidf.docs)))
+
+
+
+def write_tfidf(filepath, tfidf):
+    """
+write tfidf in csv file, one row per document with tokens:
+    doc key; [(token, tfidf), ...]; document norm
+tfidf: TfidfMatrix
     """
     init = time.time()
     logger_global.info('Writing TF*IDF on file...')
     
-    # transposing tfidf nested dictionaries for printing
-    tfidf_t = \
-        {d : {k:tfidf[k][d] for k in tfidf if d in tfidf[k]} for d in doc_list}
+    terms = tfidf.terms
+    data = tfidf.data.tolist()
+    indices = tfidf.indices.tolist()
+    indptr = tfidf.indptr.tolist()
+    norms = doc_norms(tfidf).tolist()
     
     with open(filepath, 'w', newline='') as csv_file:
         csv_writer = csv.writer(csv_file, delimiter=';')
-        #csv_writer.writerow(['doc keys']+
-        #                    [token for token, _ in inv_ix.items()])
-        for key in doc_list:
+        for i, key in enumerate(tfidf.docs):
+            start, end = indptr[i], indptr[i+1]
+            if start == end: continue
             csv_writer.writerow([key]+
-             [[(token, tfidf_t[key][token]) for token in tfidf_t[key].keys()]])
+             [[(terms[j], w) for j, w in zip(indices[start:end],
+                                             data[start:end])]]+
+             [norms[i]])
+    
+    end = time.time() - init
+    metrics.observe('write', end)
+    logger_global.info('Write operation finished in %s s' % str(end))
+
+
+
+def write_model(filepath, tfidf, generation=0, rows=None, index=None):
+    """
+write tfidf in the binary model format (see binary_model), which the
+searcher memory-maps instead of parsing; documents without tokens are left
+out, as in the csv file
+tfidf: TfidfMatrix
+rows (optional): range of document rows to write (one shard)
+index (optional): identity of the segments the model comes from
+    """
+    init = time.time()
+    logger_global.info('Writing binary TF*IDF model on '+filepath+'...')
+    
+    if rows is None:
+        rows = range(len(tfidf.docs))
+    lengths = np.diff(tfidf.indptr[rows.start:rows.stop+1])
+    keep = np.flatnonzero(lengths)
+    indptr = np.zeros(len(keep)+1, dtype=np.int64)
+    np.cumsum(lengths[keep], out=indptr[1:])
+    
+    # only the terms used by these rows, renumbered
+    first, last = tfidf.indptr[rows.start], tfidf.indptr[rows.stop]
+    used, indices = np.unique(tfidf.indices[first:last], return_inverse=True)
+    
+    binary_model.write_model(filepath,
+                             [tfidf.docs[rows.start+i] for i in keep.tolist()],
+                             [tfidf.terms[j] for j in used.tolist()],
+                             indptr, indices, tfidf.data[first:last],
+                             doc_norms(tfidf)[rows.start:rows.stop][keep],
+                             generation,
+                             [] if index is None else
+                             [('index', np.frombuffer(index.encode('ascii'),
+                                                      dtype=np.uint8))])
     
     end = time.time() - init
+    metrics.observe('write', end)
     logger_global.info('Write operation finished in %s s' % str(end))
 
 
 
+def shard_path(filepath, shard):
+    """
+returns the file name of one shard: indexer_out.mdl -> indexer_out.0.mdl
+    """
+    return filepath[:-len('.mdl')]+'.%d.mdl' % shard
+
+
+
+def write_shards(filepath, tfidf, shards, generation=0, index=None):
+    """
+splits the collection in document shards (contiguous rows with about the
+same number of postings) and writes one binary model per shard
+the weights come from the whole collection TF*IDF, so IDF (and every
+score) is the same as in the unsharded model
+    """
+    nnz = tfidf.indptr[-1]
+    bounds = np.searchsorted(tfidf.indptr,
+                             np.linspace(0, nnz, shards+1)[1:-1])
+    bounds = [0] + sorted({b for b in bounds.tolist()
+                           if 0 < b < len(tfidf.docs)}) + [len(tfidf.docs)]
+    for shard in range(len(bounds)-1):
+        write_model(shard_path(filepath, shard), tfidf, generation,
+                    range(bounds[shard], bounds[shard+1]), index)
+    logger_global.info('Collection written in %s shards' % (len(bounds)-1))
+
+
+
 if __name__ == '__main__':
 
     import os
@@ -5,10 +5,20 @@ Created on Sat Aug 25 09:51:37 2018
 @author: thabata
 """
 
-from nltk.tokenize import word_tokenize
-from nltk.stem.porter import PorterStemmer
-from nltk.corpus import stopwords
+from analyzer import make_analyzer
+from spimi import BlockIndexer
+import binary_index
+import segments
+import metrics
+import profiler
+import os
 from xml.dom.minidom import parse
+from xml.etree.ElementTree import iterparse
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from itertools import islice
+from collections import Counter
+from array import array
 import logging
 import time
 
@@ -23,54 +33,159 @@ calls functions to read data and create inverted index
     log('inverted_index_generator', log_path)
     logger_global = logging.getLogger('inverted_index_generator')
     logger_global.info('Processing Inverted Index Generator Module...')
+    profiler.configure(log_path, config_vector)
 
     docs_array = []
     docs_keys = []
-    
-    stop_words = set(stopwords.words('english'))
+    inv_ix = None
     
     use_mode = config_vector[0][1]
+    read_mode = 'DOM'
+    tokenizer_mode = 'NLTK'
+    workers = 1
+    memory = 0
+    seg_dir = None
     outfile_inverted_index = 0
     for config in config_vector:
-        if str(config[0]) == 'LEIA':            
-            partial_docs_array, partial_docs_keys = \
-                                    read_XML(path+str(config[1]).strip())
-            
-            logger_global.info('Tokenizing documents...')
-            if use_mode == 'STEMMER':
-                stemmer = PorterStemmer()
-                docs_array += tokenizer(partial_docs_array,
-                                              stop_words,
-                                              stemmer)
-                docs_keys += partial_docs_keys
-            elif use_mode == 'NOSTEMMER':
-                docs_array += tokenizer(partial_docs_array,
-                                              stop_words,
-                                              None)
-                docs_keys += partial_docs_keys                
-            else: print("ERROR: Use mode undefined.")
-            
+        if str(config[0]) == 'LEITURA':
+            read_mode = config[1].strip()
+        elif str(config[0]) == 'TOKENIZADOR':
+            tokenizer_mode = config[1].strip()
+        elif str(config[0]) == 'WORKERS':
+            workers = int(config[1])
+        elif str(config[0]) == 'MEMORIA':
+            memory = float(config[1])
         elif str(config[0]) == 'ESCREVA':
             outfile_inverted_index = path+config[1].strip()
+        elif str(config[0]) == 'SEGMENTOS':
+            seg_dir = path+config[1].strip()
+    
+    done_sources = set()
+    sources = []
+    if seg_dir is not None:
+        done_sources = segments.indexed_sources(seg_dir)
+        outfile_inverted_index = seg_dir+'/'
+        logger_global.info('Incremental indexing into segments at '+seg_dir)
     
     if not outfile_inverted_index:
         outfile_inverted_index = path+'/2-INVERTED_INDEX/inverted_index_out.csv'
         logger_global.warning('Log file for Inverted Index not specified. '
                              'Applying default: '+outfile_inverted_index)
+    
+    blocks = None
+    if memory > 0:
+        logger_global.info('Building index in blocks of %s MB' % memory)
+        blocks = BlockIndexer(int(memory*2**20),
+                              os.path.dirname(outfile_inverted_index))
+    
+    elif read_mode == 'STREAM':
+        # records are inverted as they stream in: no token arrays are kept
+        inv_ix = {}
+    
+    analyzer = make_analyzer(use_mode, tokenizer_mode)
+    
+    pool = None
+    if workers > 1 and analyzer is not None:
+        logger_global.info('Tokenizing with %s worker processes' % workers)
+        pool = ProcessPoolExecutor(max_workers=workers,
+                                   initializer=tokenizer_worker,
+                                   initargs=(analyzer,))
+
+    for config in config_vector:
+        if str(config[0]) == 'LEIA':
+            if config[1].strip() in done_sources:
+                logger_global.info(config[1].strip()+' already indexed in a '
+                                   'segment, skipping it')
+                continue
+            if config[1].strip() in sources:
+                logger_global.warning(config[1].strip()+' listed more than '
+                                      'once, skipping the repeat')
+                continue
+            sources.append(config[1].strip())
+            # streamed records are parsed while tokenizing
+            if read_mode == 'STREAM':
+                partial_docs_keys = []
+                partial_docs_array = split_records(
+                                    stream_XML(path+str(config[1]).strip()),
+                                    partial_docs_keys)
+            else:
+                with profiler.stage('parse'):
+                    partial_docs_array, partial_docs_keys = \
+                                    read_XML(path+str(config[1]).strip())
+            
+            logger_global.info('Tokenizing documents...')
+            # streamed records are parsed inside the tokenizing loop: one
+            # profiler stage, 'stream', for both (see profiler)
+            with profiler.stage('stream' if read_mode == 'STREAM'
+                                else 'tokenize'):
+                if analyzer is not None and blocks is not None:
+                    block_tokenizer(partial_docs_array, analyzer, blocks,
+                                    pool, workers)
+                    docs_keys += partial_docs_keys
+                elif analyzer is not None and inv_ix is not None:
+                    inverting_tokenizer(partial_docs_array, analyzer, inv_ix,
+                                        len(docs_keys), pool, workers)
+                    docs_keys += partial_docs_keys
+                elif analyzer is not None:
+                    docs_array += tokenizer(partial_docs_array,
+                                                  analyzer,
+                                                  pool, workers)
+                    docs_keys += partial_docs_keys
+                else: print("ERROR: Use mode undefined.")
+    
+    if pool is not None:
+        pool.shutdown()
+    if analyzer is not None:
+        for line in analyzer.report():
+            logger_global.info('Analyzer '+line)
 
     end = time.time() - begin
     start = time.time()
     logger_global.info('All %s documents read and tokenized successfully '
-                      'in %s s' % (str(len(docs_array)), str(end)))
+                      'in %s s' % (str(len(docs_keys)), str(end)))
+    
+    # the k-way merge of the blocks runs lazily, while writing
+    if blocks is not None:
+        logger_global.info('Merging %s runs...' % (len(blocks.runs) +
+                                                   bool(blocks.block)))
+        inv_ix = blocks.merge()
+    elif inv_ix is not None:
+        inv_ix = inv_ix.items()
+    else:
+        with profiler.stage('invert'):
+            inv_ix = inverted_index_minion(docs_array, docs_keys).items()
+    
+    with profiler.stage('write'):
+        if seg_dir is not None:
+            if docs_keys:
+                name = segments.add_segment(seg_dir, inv_ix, docs_keys,
+                                            sources)
+                logger_global.info('Segment %s added with %s documents' %
+                                   (name, len(docs_keys)))
+                merges = segments.merge_policy(seg_dir)
+                if merges:
+                    logger_global.info('%s segment merges' % merges)
+            else:
+                logger_global.info('No new documents: segments unchanged')
+        elif outfile_inverted_index.endswith('.lex'):
+            write_binary_index(outfile_inverted_index, inv_ix, docs_keys)
+        else:
+            write_inverted_index(outfile_inverted_index, inv_ix, docs_keys)
     
-    write_inverted_index(outfile_inverted_index,
-                         inverted_index_minion(docs_array, docs_keys),
-                         docs_keys)
+    if blocks is not None:
+        blocks.close()
     
     end = time.time() - start
     logger_global.info('Write operation finished with %s s' % str(end))
     
     end = time.time() - begin
+    metrics.count('documents', len(docs_keys))
+    metrics.count('files', len(sources))
+    metrics.observe('run', end)
+    metrics.export(metrics.metrics_path(path, log_path, config_vector),
+                   {'module': 'inverted_index'})
+    for filepath in profiler.finish():
+        logger_global.info('Profile written on '+filepath)
     logger_global.info('End of Inverted Index Generator Module. '
                    'Total of %s elapsed.' % str(end))
 
@@ -110,12 +225,68 @@ returns two arrays: documents and their keys
                         doesn't have abstract neither extract!")
     
     finish = time.time() - init
+    metrics.observe('parse', finish)
     logger_global.info('%s records read succesfully in %s s.' % 
                           (str(len(docs)), str(finish)))
     return docs, docs_keys
 
 
 
+def stream_XML(filename):
+    """
+reads data from xml files incrementally, one RECORD at a time
+yields tuples: (document key, document text)
+each RECORD is cleared once read, so the parse tree doesn't grow with the
+file size (the index being built does: MEMORIA= bounds it, see spimi)
+the parse time only counts the steps of this generator, not the consumer's
+work between records (and tokenizing leaves the steps out, see tokenizer)
+    """
+    logger_global.info('Streaming '+filename+' file...')
+    init = time.time()
+    
+    parsing = 0.
+    n_docs = 0
+    root = None
+    step = time.perf_counter()
+    for event, elem in iterparse(filename, events=('start', 'end')):
+        if root is None:
+            root = elem
+        if event != 'end' or elem.tag != 'RECORD':
+            continue
+        
+        rec_num = elem.findtext('RECORDNUM')
+        text = elem.findtext('ABSTRACT') or elem.findtext('EXTRACT')
+        elem.clear()
+        root.clear()
+        if text:
+            n_docs += 1
+            parsing += time.perf_counter() - step
+            yield rec_num, text
+            step = time.perf_counter()
+        else:
+            logger_global.warning(
+                    "Document["+rec_num+"] \
+                    doesn't have abstract neither extract!")
+    
+    parsing += time.perf_counter() - step
+    finish = time.time() - init
+    metrics.observe('parse', parsing)
+    logger_global.info('%s records read succesfully in %s s (%s s parsing).'
+                       % (str(n_docs), str(finish), str(parsing)))
+
+
+
+def split_records(records, docs_keys):
+    """
+unzips (document key, document text) tuples on the fly
+appends keys to docs_keys and yields texts
+    """
+    for key, text in records:
+        docs_keys.append(key)
+        yield text
+
+
+
 def log(name, log_file):
     """
 instantiates the logging
@@ -137,30 +308,137 @@ instantiates the logging
 
 
 
-def tokenizer(docs, stop, stemmer):
+def tokenizer(docs, analyzer, pool=None, workers=1, chunk_size=64):
     """
-tokenize documents and pre-process
+tokenize documents and pre-process with the shared analyzer
 - with stemmer (or not)
 - removes small words (1-2 chars)
 - removes numbers
+the time spent reading docs (streamed records are parsed on demand) is left
+out, it is the parse stage's
 returns array of arrays (list of tokens in each document)
     """
     init = time.time()
-    import re
-    regex = re.compile('^\d*[.,]?\d*$')
     
-    tok_docs = []
-    for doc in docs:
-        toks = [stemmer.stem(tok) for tok in word_tokenize(doc)
-                                        if not tok in stop
-                                        if len(tok)>2
-                                        if regex.match(tok)==None]
-        tok_docs.append(toks)
+    reading = metrics.Stopwatch()
+    tok_docs = list(tokenizer_stream(reading.pull(docs), analyzer, pool,
+                                     workers, chunk_size))
 
-    finish = time.time() - init
+    finish = time.time() - init - reading.elapsed
+    metrics.observe('tokenize', finish)
     logger_global.info('%s records tokenized succesfully in %s s.' % 
-                          (str(len(docs)), str(finish)))
+                          (str(len(tok_docs)), str(finish)))
+
+    return tok_docs
+
+
+
+def block_tokenizer(docs, analyzer, blocks, pool=None, workers=1,
+                    chunk_size=64):
+    """
+tokenize documents like tokenizer(), but hands each one straight to the
+block indexer instead of keeping them (see spimi)
+    """
+    init = time.time()
+    n_runs = len(blocks.runs)
+    
+    reading = metrics.Stopwatch()
+    n_docs = 0
+    for toks in tokenizer_stream(reading.pull(docs), analyzer, pool,
+                                 workers, chunk_size):
+        blocks.add(toks)
+        n_docs += 1
+
+    finish = time.time() - init - reading.elapsed
+    metrics.observe('tokenize', finish)
+    logger_global.info('%s records tokenized succesfully in %s s. '
+                       '%s runs flushed.' % 
+                          (str(n_docs), str(finish),
+                           str(len(blocks.runs) - n_runs)))
+
+
 
+def inverting_tokenizer(docs, analyzer, inv_ix, first_id=0, pool=None,
+                        workers=1, chunk_size=64):
+    """
+tokenize documents like tokenizer(), but adds each one to inv_ix right
+away (see add_postings) instead of keeping its tokens
+doc ids go on from first_id
+    """
+    init = time.time()
+    
+    reading = metrics.Stopwatch()
+    inverting = 0.
+    doc_id = first_id
+    for toks in tokenizer_stream(reading.pull(docs), analyzer, pool,
+                                 workers, chunk_size):
+        step = time.perf_counter()
+        add_postings(inv_ix, doc_id, toks)
+        inverting += time.perf_counter() - step
+        doc_id += 1
+
+    finish = time.time() - init - reading.elapsed
+    metrics.observe('tokenize', finish - inverting)
+    metrics.observe('invert', inverting)
+    logger_global.info('%s records tokenized and inverted succesfully in '
+                       '%s s (%s s inverting).' %
+                          (str(doc_id - first_id), str(finish),
+                           str(inverting)))
+
+
+
+def tokenizer_stream(docs, analyzer, pool=None, workers=1, chunk_size=64):
+    """
+yields the token array of each document, in order
+with a process pool, documents are sent in chunks of chunk_size and the
+chunks are collected back in order (at most 2*workers chunks in flight)
+    """
+    if pool is None:
+        for doc in docs:
+            yield analyzer.analyze(doc)
+        return
+    
+    pending = deque()
+    docs = iter(docs)
+    chunk = list(islice(docs, chunk_size))
+    while chunk:
+        pending.append(pool.submit(tokenizer_minion, chunk))
+        if len(pending) >= 2*workers:
+            yield from collect(pending.popleft(), analyzer)
+        chunk = list(islice(docs, chunk_size))
+    while pending:
+        yield from collect(pending.popleft(), analyzer)
+
+
+
+def tokenizer_worker(analyzer):
+    """
+initializes a pool worker with its own copy of the analyzer
+(the stem cache is then kept warm across chunks)
+    """
+    global worker_analyzer
+    worker_analyzer = analyzer
+
+
+
+def tokenizer_minion(docs):
+    """
+actually tokenizes a chunk of documents inside a pool worker
+returns tuple: (array of token arrays, analyzer counters for the chunk)
+    """
+    worker_analyzer.reset_counters()
+    tok_docs = worker_analyzer.analyze_all(docs)
+    return tok_docs, worker_analyzer.snapshot()
+
+
+
+def collect(future, analyzer):
+    """
+waits for a tokenizer_minion chunk and merges its counters
+returns array of token arrays
+    """
+    tok_docs, stats = future.result()
+    analyzer.merge_counters(stats)
     return tok_docs
 
 
@@ -168,38 +446,85 @@ returns array of arrays (list of tokens in each document)
 def inverted_index_minion(docs, docs_keys):
     """
 actually creates the inverted index (the minion always does all the work)
-returns dictionary - keys as index for doc_num array; values as token arrays
+documents get dense integer ids: doc id = position of its key in docs_keys
+returns dictionary - keys as tokens; values as postings, i.e. array('I') of
+interleaved (doc id, frequency) pairs, one pair per document with the token
     """
     logger_global.info('Making inverted index...')
     init = time.time()
     
     inv_ix = {}
-    i=0
-    for doc, key in zip(docs, docs_keys):
-        for token in doc:
-            try: inv_ix[token].append(key)
-            except: inv_ix[token] = [key]
-            i+=1
+    for doc_id, doc in enumerate(docs):
+        add_postings(inv_ix, doc_id, doc)
     
     finish = time.time() - init
+    metrics.observe('invert', finish)
     logger_global.info('Inverted index created in %s s' % str(finish))
     return inv_ix
 
 
 
+def add_postings(inv_ix, doc_id, tokens):
+    """
+adds one tokenized document to the inverted index
+    """
+    for token, freq in Counter(tokens).items():
+        try: postings = inv_ix[token]
+        except KeyError: postings = inv_ix[token] = array('I')
+        postings.append(doc_id)
+        postings.append(freq)
+
+
+
+def expand_postings(postings, docs_reprs):
+    """
+adapter from compact postings to the csv format: the document key repeated
+once per occurrence of the token, e.g. ['00001 ', '00001 ', '00003 ']
+docs_reprs[doc id] = repr of the document key
+returns string
+    """
+    return '[' + ', '.join([docs_reprs[postings[i]]
+                            for i in range(0, len(postings), 2)
+                            for _ in range(postings[i+1])]) + ']'
+
+
+
 def write_inverted_index(filepath, inv_ix, docs_keys):
     """
 write inverted index in csv file
+inv_ix: iterable of (token, postings)
     """
     logger_global.info('Writing Inverted Index on file...')
     init = time.time()
     
+    docs_reprs = [repr(key) for key in docs_keys]
     f = open(filepath, 'w+')
-    for key in inv_ix.keys():
-        f.write(key.upper()+";%s\n" % inv_ix[key])     
+    for key, postings in inv_ix:
+        f.write(key.upper()+";%s\n" % expand_postings(postings, docs_reprs))
     f.close()
     
     finish = time.time() - init
+    metrics.observe('write', finish)
+    logger_global.info('Inverted index written in %s s' % str(finish))
+
+
+
+def write_binary_index(filepath, inv_ix, docs_keys):
+    """
+write inverted index in binary files: sorted lexicon (.lex) and
+delta + varint compressed postings (.pst), see binary_index
+inv_ix: iterable of (token, postings)
+    """
+    logger_global.info('Writing binary Inverted Index on file...')
+    init = time.time()
+    
+    binary_index.write_index(filepath,
+                             ((key.upper(), postings)
+                              for key, postings in inv_ix),
+                             docs_keys)
+    
+    finish = time.time() - init
+    metrics.observe('write', finish)
     logger_global.info('Inverted index written in %s s' % str(finish))
 
 
@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 23:12:37 2026
+@author: thabata
+
+load tester of the search server: replays the queries (CONSULTAS=, tokens
+from queries_out.csv, or LEIA=, the texts of a cfquery.xml) over HTTP for
+DURACAO seconds, cycling through them
+- closed loop (MODO=FECHADO): CONCORRENCIA clients, each sending its next
+  query as soon as the previous one is answered; the server sets the pace
+- open loop (MODO=ABERTO): queries arrive at TAXA per second (Poisson
+  arrivals) whatever the server does, over at most CONCORRENCIA
+  connections; latency counts from the scheduled arrival, so the time a
+  query waits for a free connection is not hidden (coordinated omission)
+reports throughput, latency percentiles (p50, p95, p99, p99.9), errors, the
+result cache hit rate and the mean batch of the server during the test
+(from /metrics and /health); each run is appended to ESCREVA=
+"""
+
+from xml.etree.ElementTree import iterparse
+from array import array
+import metrics
+import datetime
+import asyncio
+import logging
+import random
+import json
+import csv
+import time
+import os
+
+PERCENTILES = [('p50', .5), ('p95', .95), ('p99', .99), ('p999', .999)]
+HEADER = ['date', 'mode', 'concurrency', 'target_qps', 'duration_s',
+          'requests', 'errors', 'throughput_qps'] + \
+         [name+'_ms' for name, _ in PERCENTILES] + \
+         ['max_ms', 'cache_hit_rate', 'mean_batch']
+# open loop: arrivals sent this late are reported (client too slow)
+LAG = 0.01
+
+def load_tester(path, config_vector):
+    """
+reads the configuration and the queries, runs the load test and writes its
+results
+returns dictionary of the results (see HEADER), None when there are no
+queries or the server can't be reached
+    """
+    begin = time.time()
+    global logger_global
+    log_path = path+'/7-BENCHMARK/lt.log'
+    log('load_tester', log_path)
+    logger_global = logging.getLogger('load_tester')
+    logger_global.info('Processing Load Tester Module...')
+
+    host, port = '127.0.0.1', 8080
+    mode = 'FECHADO'
+    concurrency = 8
+    rate = 100.
+    duration = 10.
+    topk = 10
+    seed = 0
+    outfile_load = path+'/7-BENCHMARK/load.csv'
+    queries = []
+    for config in config_vector:
+        if str(config[0]) == 'CONSULTAS':
+            queries += read_queries(path+config[1].strip())
+        elif str(config[0]) == 'LEIA':
+            queries += read_XML(path+config[1].strip())
+        elif str(config[0]) == 'ENDERECO':
+            host = config[1].strip()
+        elif str(config[0]) == 'PORTA':
+            port = int(config[1])
+        elif str(config[0]) == 'MODO':
+            mode = config[1].strip().upper()
+        elif str(config[0]) == 'CONCORRENCIA':
+            concurrency = int(config[1])
+        elif str(config[0]) == 'TAXA':
+            rate = float(config[1])
+        elif str(config[0]) == 'DURACAO':
+            duration = float(config[1])
+        elif str(config[0]) == 'TOPK':
+            topk = int(config[1])
+        elif str(config[0]) == 'SEMENTE':
+            seed = int(config[1])
+        elif str(config[0]) == 'ESCREVA':
+            outfile_load = path+config[1].strip()
+
+    if mode not in ('ABERTO', 'FECHADO'):
+        logger_global.warning('Undefined mode '+mode+'. '
+                              'Applying default: FECHADO')
+        mode = 'FECHADO'
+    if not queries:
+        logger_global.error('No queries to send: CONSULTAS= or LEIA= not '
+                            'specified, or their files are empty')
+        return None
+    for query in queries:
+        query['k'] = topk
+
+    logger_global.info('%s loop, %s connections%s, %s s against '
+                       'http://%s:%s/search...' %
+                       ('Open' if mode == 'ABERTO' else 'Closed',
+                        concurrency, ', %s queries/s' % rate
+                        if mode == 'ABERTO' else '', duration, host, port))
+    try:
+        result = asyncio.run(run_load(host, port, queries, mode, concurrency,
+                                      rate, duration, seed))
+    except OSError as error:
+        logger_global.error('Search server not reachable: %s' % error)
+        return None
+    result.update({'date': datetime.datetime.now().isoformat(
+                                                    timespec='seconds'),
+                   'mode': mode, 'concurrency': concurrency,
+                   'target_qps': rate if mode == 'ABERTO' else '',
+                   'duration_s': duration})
+    report(result)
+    write_load(outfile_load, result)
+
+    end = time.time() - begin
+    logger_global.info('End of Load Tester Module. '
+                       'Total of %s elapsed.' % str(end))
+    return result
+
+
+
+def read_queries(filename):
+    """
+reads the tokenized queries written by query_processor
+returns array of request bodies {'tokens': array of tokens}
+    """
+    import ast
+    logger_global.info('Reading '+filename+' file...')
+    with open(filename, 'r') as csv_file:
+        queries = [{'tokens': ast.literal_eval(row[1])}
+                   for row in csv.reader(csv_file, delimiter=';')]
+    logger_global.info('%s queries read' % len(queries))
+    return queries
+
+
+
+def read_XML(filename):
+    """
+reads the raw query texts of a cfquery.xml (analyzed by the server)
+returns array of request bodies {'q': text}
+    """
+    logger_global.info('Reading '+filename+' file...')
+    queries = []
+    for _, elem in iterparse(filename):
+        if elem.tag == 'QUERY':
+            queries.append({'q': ' '.join(elem.findtext('QueryText').split())})
+            elem.clear()
+    logger_global.info('%s queries read' % len(queries))
+    return queries
+
+
+
+class Connection:
+    """
+HTTP/1.1 keep-alive connection to the server, one request at a time
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+
+    async def request(self, method, target, payload=None):
+        """
+sends one request, (re)connecting when needed
+returns tuple: (HTTP status, body bytes)
+        """
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(
+                                                        self.host, self.port)
+        body = json.dumps(payload).encode('utf-8') if payload is not None \
+               else b''
+        try:
+            self.writer.write(('%s %s HTTP/1.1\r\n'
+                               'Host: %s:%s\r\n'
+                               'Content-Type: application/json\r\n'
+                               'Content-Length: %s\r\n\r\n' %
+                               (method, target, self.host, self.port,
+                                len(body))).encode('latin-1') + body)
+            await self.writer.drain()
+            status = int((await self.reader.readline()).split()[1])
+            length = 0
+            while True:
+                line = await self.reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                if name.strip().lower() == 'content-length':
+                    length = int(value)
+            return status, await self.reader.readexactly(length)
+        except (ConnectionError, asyncio.IncompleteReadError, IndexError,
+                ValueError):
+            self.close()
+            raise ConnectionError('connection to the server lost')
+
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+
+async def run_load(host, port, queries, mode, concurrency, rate, duration,
+                   seed=0):
+    """
+returns dictionary: requests, errors, throughput, latency percentiles (ms),
+cache hit rate and mean batch of the server (None when unknown)
+    """
+    loop = asyncio.get_running_loop()
+    connections = [Connection(host, port) for _ in range(concurrency)]
+    before = await server_state(connections[0])
+    latencies = array('d')
+    errors = [0]
+    lags = array('d')
+
+    async def send(connection, query, since):
+        try:
+            status, _ = await connection.request('POST', '/search', query)
+        except ConnectionError:
+            status = None
+        if status == 200:
+            latencies.append(loop.time() - since)
+        else:
+            errors[0] += 1
+
+    start = loop.time()
+    end = start + duration
+    if mode == 'FECHADO':
+        async def client(i, connection):
+            while loop.time() < end:
+                await send(connection, queries[i % len(queries)], loop.time())
+                i += concurrency
+        await asyncio.gather(*[client(i, connection)
+                               for i, connection in enumerate(connections)])
+    else:
+        idle = asyncio.Queue()
+        for connection in connections:
+            idle.put_nowait(connection)
+
+        async def arrival(query, scheduled):
+            connection = await idle.get()
+            try:
+                await send(connection, query, scheduled)
+            finally:
+                idle.put_nowait(connection)
+
+        rng = random.Random(seed)
+        tasks = []
+        scheduled = start
+        while True:
+            scheduled += rng.expovariate(rate)
+            if scheduled >= end:
+                break
+            delay = scheduled - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            lags.append(loop.time() - scheduled)
+            tasks.append(asyncio.create_task(
+                            arrival(queries[len(tasks) % len(queries)],
+                                    scheduled)))
+        await asyncio.gather(*tasks)
+    elapsed = loop.time() - start
+
+    after = await server_state(connections[0])
+    for connection in connections:
+        connection.close()
+
+    ordered = sorted(latencies)
+    result = {'requests': len(ordered) + errors[0], 'errors': errors[0],
+              'throughput_qps': len(ordered) / elapsed,
+              'max_ms': ordered[-1] * 1000. if ordered else None,
+              'late': sum(lag > LAG for lag in lags)}
+    for name, q in PERCENTILES:
+        result[name+'_ms'] = metrics.quantile(ordered, q) * 1000. \
+                             if ordered else None
+    result.update(server_delta(before, after))
+    return result
+
+
+
+async def server_state(connection):
+    """
+returns dictionary: cache hits and misses (None without cache), queries and
+batches served so far
+    """
+    _, body = await connection.request('GET', '/metrics')
+    counters = {}
+    for line in body.decode('utf-8').splitlines():
+        for name in ('cache_hits', 'cache_misses'):
+            if line.startswith(metrics.PREFIX+name+'_total'):
+                counters[name] = float(line.rsplit(' ', 1)[1])
+    _, body = await connection.request('GET', '/health')
+    health = json.loads(body)
+    return {'cache_hits': counters.get('cache_hits'),
+            'cache_misses': counters.get('cache_misses'),
+            'cache': health['cache'] is not None,
+            'queries': health['queries'], 'batches': health['batches']}
+
+
+
+def server_delta(before, after):
+    """
+returns dictionary: cache hit rate and mean batch size over the test
+    """
+    delta = {'cache_hit_rate': None, 'mean_batch': None}
+    if after['cache']:
+        hits = (after['cache_hits'] or 0) - (before['cache_hits'] or 0)
+        misses = (after['cache_misses'] or 0) - (before['cache_misses'] or 0)
+        if hits + misses:
+            delta['cache_hit_rate'] = hits / (hits + misses)
+    batches = after['batches'] - before['batches']
+    if batches:
+        delta['mean_batch'] = (after['queries'] - before['queries']) / batches
+    return delta
+
+
+
+def report(result):
+    """
+logs the results of the load test
+    """
+    logger_global.info('%s requests, %s errors, %.1f queries/s' %
+                       (result['requests'], result['errors'],
+                        result['throughput_qps']))
+    if result['max_ms'] is not None:
+        logger_global.info('Latency ms: ' + ', '.join(
+                           '%s %.2f' % (name, result[name+'_ms'])
+                           for name, _ in PERCENTILES) +
+                           ', max %.2f' % result['max_ms'])
+    if result['mode'] == 'ABERTO':
+        if result['late']:
+            logger_global.warning('%s arrivals sent more than %s ms late: '
+                                  'the client (or its machine) is saturated, '
+                                  'the load is lower than requested' %
+                                  (result['late'], LAG*1000))
+        if result['throughput_qps'] < 0.95 * result['target_qps']:
+            logger_global.warning('Server fell behind: %.1f of %s queries/s'
+                                  % (result['throughput_qps'],
+                                     result['target_qps']))
+    if result['cache_hit_rate'] is not None:
+        logger_global.info('Result cache hit rate %.1f%%' %
+                           (100. * result['cache_hit_rate']))
+    if result['mean_batch'] is not None:
+        logger_global.info('Mean batch %.2f queries' % result['mean_batch'])
+
+
+
+def write_load(filepath, result):
+    """
+appends the load test to csv file (header when new)
+    """
+    logger_global.info('Writing load test on file...')
+    new = not os.path.exists(filepath)
+    with open(filepath, 'a', newline='') as csv_file:
+        csv_writer = csv.writer(csv_file, delimiter=';')
+        if new:
+            csv_writer.writerow(HEADER)
+        csv_writer.writerow(['' if result[column] is None else
+                             '%.3f' % result[column]
+                             if isinstance(result[column], float) else
+                             result[column] for column in HEADER])
+
+
+
+def log(name, log_file):
+    """
+instantiates the logging
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    # create a file handler
+    handler = logging.FileHandler(log_file)
+    handler.setLevel(logging.INFO)
+    # create a logging format
+    formatter = logging.Formatter(
+                    '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    handler.setFormatter(formatter)
+    streamHandler = logging.StreamHandler()
+    streamHandler.setFormatter(formatter)
+    # add the handlers to the logger
+    logger.addHandler(handler)
+    logger.addHandler(streamHandler)
+
+
+
+if __name__ == '__main__':
+
+    PATH = os.path.dirname(os.path.abspath(__file__))
+
+    config_file = '/7-BENCHMARK/lt.cfg'
+
+    with open(PATH+config_file.strip(), 'r') as configuration:
+        config_vector=[]
+        for line in configuration:
+            line = line.strip()
+            config_vector.append(line.split('='))
+
+    load_tester(PATH, config_vector)
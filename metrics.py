@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 19:10:37 2026
+@author: thabata
+
+run metrics: counters and latency histograms (seconds) per pipeline stage
+(parse, tokenize, invert, tfidf, load, score, write, ...), kept in one
+registry per process and exported at the end of a run as a Prometheus
+textfile (.prom, for node_exporter's textfile collector) or JSON (.json,
+with exact p50/p95/p99)
+
+observing a duration is one array append; quantiles and buckets are only
+computed on export
+"""
+
+from array import array
+import json
+import os
+import time
+
+PREFIX = 'search_engine_'
+# histogram buckets (seconds), Prometheus style upper bounds
+BUCKETS = (.00005, .0001, .00025, .0005, .001, .0025, .005, .01, .025, .05,
+           .1, .25, .5, 1., 2.5, 5., 10., 30., 60.)
+QUANTILES = (.5, .95, .99)
+
+
+
+class Metrics:
+    """
+registry of counters and histograms (raw samples)
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.samples = {}
+
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+
+    def observe(self, name, seconds):
+        try: self.samples[name].append(seconds)
+        except KeyError: self.samples[name] = array('d', [seconds])
+
+
+    def timer(self, name):
+        return Timer(self, name)
+
+
+    def drain(self):
+        """
+takes the contents of the registry, leaving it empty (e.g. to send the
+metrics of a pool worker back to the coordinator, see merge)
+returns tuple: (counters, samples)
+        """
+        state = self.counters, self.samples
+        self.counters, self.samples = {}, {}
+        return state
+
+
+    def merge(self, state):
+        counters, samples = state
+        for name, value in counters.items():
+            self.count(name, value)
+        for name, values in samples.items():
+            try: self.samples[name].extend(values)
+            except KeyError: self.samples[name] = array('d', values)
+
+
+    def summary(self):
+        """
+returns dictionary: counters and, per histogram, count, sum, max,
+quantiles and cumulative bucket counts
+        """
+        histograms = {}
+        for name, values in sorted(self.samples.items()):
+            ordered = sorted(values)
+            buckets, i = [], 0
+            for bound in BUCKETS:
+                while i < len(ordered) and ordered[i] <= bound:
+                    i += 1
+                buckets.append([bound, i])
+            histogram = {'count': len(ordered), 'sum': sum(ordered),
+                         'max': ordered[-1], 'buckets': buckets}
+            for q in QUANTILES:
+                histogram['p%g' % (100*q)] = quantile(ordered, q)
+            histograms[name] = histogram
+        return {'counters': dict(sorted(self.counters.items())),
+                'histograms': histograms}
+
+
+    def prometheus(self, labels=None):
+        """
+returns string in the Prometheus text exposition format
+        """
+        labels = ','.join('%s="%s"' % item
+                          for item in sorted((labels or {}).items()))
+        summary = self.summary()
+        lines = []
+        for name, value in summary['counters'].items():
+            metric = PREFIX+name+'_total'
+            lines.append('# TYPE %s counter' % metric)
+            lines.append('%s{%s} %r' % (metric, labels, value))
+        for name, histogram in summary['histograms'].items():
+            metric = PREFIX+name+'_seconds'
+            sep = ',' if labels else ''
+            lines.append('# TYPE %s histogram' % metric)
+            for bound, count in histogram['buckets']:
+                lines.append('%s_bucket{%s%sle="%r"} %s' %
+                             (metric, labels, sep, bound, count))
+            lines.append('%s_bucket{%s%sle="+Inf"} %s' %
+                         (metric, labels, sep, histogram['count']))
+            lines.append('%s_sum{%s} %r' % (metric, labels, histogram['sum']))
+            lines.append('%s_count{%s} %s' %
+                         (metric, labels, histogram['count']))
+        return '\n'.join(lines) + '\n'
+
+
+    def export(self, filepath, labels=None):
+        """
+writes the metrics atomically (temporary file + rename): JSON if filepath
+ends with .json, Prometheus textfile otherwise
+        """
+        with open(filepath+'.tmp', 'w') as out:
+            if filepath.endswith('.json'):
+                json.dump(dict(labels or {}, **self.summary()), out, indent=1)
+            else:
+                out.write(self.prometheus(labels))
+        os.replace(filepath+'.tmp', filepath)
+
+
+
+class Timer:
+    """
+context manager observing the elapsed time of its block (kept in elapsed,
+seconds, once the block is over)
+    """
+    __slots__ = ('metrics', 'name', 'init', 'elapsed')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+
+    def __enter__(self):
+        self.init = time.perf_counter()
+        return self
+
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.init
+        self.metrics.observe(self.name, self.elapsed)
+
+
+
+class Stopwatch:
+    """
+time spent producing the items of an iterable (see pull), e.g. a streaming
+parser feeding a stage timed on its own, which then leaves it out
+    """
+    __slots__ = ('elapsed',)
+
+    def __init__(self):
+        self.elapsed = 0.
+
+
+    def pull(self, iterable):
+        """
+yields the items of iterable, adding the time of each step to elapsed
+        """
+        iterator = iter(iterable)
+        while True:
+            step = time.perf_counter()
+            try: item = next(iterator)
+            except StopIteration:
+                self.elapsed += time.perf_counter() - step
+                return
+            self.elapsed += time.perf_counter() - step
+            yield item
+
+
+
+def quantile(ordered, q):
+    """
+ordered: sorted samples
+returns the q-quantile, linear interpolation between closest ranks
+    """
+    position = q * (len(ordered) - 1)
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+
+def metrics_path(path, log_path, config_vector):
+    """
+where the metrics of a run go: METRICAS= if configured (relative to path),
+otherwise next to the module's log (xx.log -> xx_metrics.prom)
+    """
+    for config in config_vector:
+        if str(config[0]) == 'METRICAS':
+            return path+config[1].strip()
+    return os.path.splitext(log_path)[0]+'_metrics.prom'
+
+
+
+# registry of this process
+registry = Metrics()
+count = registry.count
+observe = registry.observe
+timer = registry.timer
+drain = registry.drain
+merge = registry.merge
+export = registry.export
@@ -5,7 +5,10 @@ Created on Sat Aug 25 14:54:15 2018
 @author: thabata
 """
 import csv
-from math import sqrt
+import evaluation
+import metrics
+import profiler
+import significance
 import logging
 import time
 
@@ -22,16 +25,43 @@ calls functions to read inverted index and creates TF.IDF matrix
     log('performance', log_path)
     logger_global = logging.getLogger('performance')
     logger_global.info('Processing Performance Evaluator Module...')
-
+    profiler.configure(log_path, config_vector)
+
+    plots_dir = None
+    # comparison mode: runs compared against RESULTADOS, one per COMPARAR=
+    compared = []
+    resamples = significance.RESAMPLES
+    seed = 0
+    outfile_comparison = path+'/6-PERFORMANCE/comparison.csv'
     for config in config_vector:
         if str(config[0]) == 'RESULTADOS':            
-            results = read_results(path+config[1].strip())
+            with profiler.stage('load'):
+                results = read_results(path+config[1].strip())
+            baseline_name = config[1].strip()
             
         elif str(config[0]) == 'ESPERADOS':
-            answers = read_answers(path+config[1].strip())
+            with profiler.stage('load'):
+                answers = read_answers(path+config[1].strip())
         
         elif str(config[0]) == 'DESEMPENHO':
             outfile_performance = path+config[1]
+        
+        elif str(config[0]) == 'GRAFICOS':
+            plots_dir = path+config[1].strip()
+
+        elif str(config[0]) == 'COMPARAR':
+            with profiler.stage('load'):
+                compared.append((config[1].strip(),
+                                 read_results(path+config[1].strip())))
+
+        elif str(config[0]) == 'AMOSTRAS':
+            resamples = int(config[1])
+
+        elif str(config[0]) == 'SEMENTE':
+            seed = int(config[1])
+
+        elif str(config[0]) == 'COMPARACAO':
+            outfile_comparison = path+config[1].strip()
     
     if not (outfile_performance):
         outfile_performance = path+'/6-PERFORMANCE/performance.csv'
@@ -39,31 +69,121 @@ calls functions to read inverted index and creates TF.IDF matrix
                              'Applying default: '+outfile_performance)
 
     end = time.time() - begin
+    metrics.observe('load', end)
     logger_global.info('Results and answers read succesfully '
                       'in %s s' % str(end))
     
     logger_global.info('Calculating performance...')
+    start = time.time()
     
-    performance_raw = precision_recall(answers, results)
-    performance = interpolated_precision_recall(performance_raw)
-    curve_11 = eleven_point_curve(performance)
-    ndcg(answers, results)
+    with profiler.stage('evaluate'):
+        run = evaluation.evaluate(answers, results)
+        performance = {key: query.interpolated()
+                       for key, query in run.items()}
+        curve_11 = evaluation.eleven_point_curve(run)
+        ndcg = {key: query.final_ndcg() for key, query in run.items()}
+        measures = evaluation.summary(run)
     
-    end = time.time() - end
+    end = time.time() - start
+    metrics.observe('evaluate', end)
     logger_global.info('Performance calculated succesfully '
                       'in %s s' % str(end))
+    for name, value in measures.items():
+        logger_global.info('Mean %s is %s' % (name, value))
+    x = list(ndcg.keys())
+    y = [ndcg[key] for key in x]
+    logger_global.info('Maximum NDCG is '+str(max(y))+' for '+ x[y.index(max(y))])
+    logger_global.info('Minimum NDCG is '+str(min(y))+' for '+ x[y.index(min(y))])
 
-    write_performance(outfile_performance, performance)
+    with profiler.stage('write'):
+        write_performance(outfile_performance, performance)
     #show_precision_recall(performance, '00005', 20)
     #print_precision_recall_curves(performance)
-    show_11_point_curve(curve_11)
+    # plots (and matplotlib) only on request
+    if plots_dir is not None:
+        with profiler.stage('plot'):
+            show_11_point_curve(curve_11, plots_dir+'/11PointCurve.png')
+            show_ndcg(ndcg, plots_dir+'/NDCG.png')
+            logger_global.info('Plots saved in '+plots_dir)
+    if compared:
+        with profiler.stage('compare'):
+            comparison = compare_runs(answers, baseline_name, run, compared,
+                                      resamples, seed)
+            write_comparison(outfile_comparison, comparison)
 
     end = time.time() - begin
+    metrics.count('queries', len(results))
+    metrics.observe('run', end)
+    metrics.export(metrics.metrics_path(path, log_path, config_vector),
+                   {'module': 'performance'})
+    for filepath in profiler.finish():
+        logger_global.info('Profile written on '+filepath)
     logger_global.info('End of Performance Evaluator Module. '
                        'Total of %s elapsed.' % str(end))
 
 
 
+def compare_runs(answers, baseline_name, baseline, compared, resamples,
+                 seed):
+    """
+baseline: evaluation of the run in RESULTADOS
+compared: array of tuples (name, results) of the other runs
+paired tests over the queries every run answered, each run against the
+baseline
+returns array of dictionaries, one per (run, measure): means, mean
+difference, bootstrap confidence interval and p-values
+    """
+    logger_global.info('Comparing %s runs against %s...' %
+                       (len(compared), baseline_name))
+    runs = [(name, evaluation.evaluate(answers, results))
+            for name, results in compared]
+    keys = [key for key in baseline if all(key in run for _, run in runs)]
+    if len(keys) < len(baseline):
+        logger_global.warning('%s queries missing from the compared runs, '
+                              'left out' % (len(baseline) - len(keys)))
+    names, baseline_table = evaluation.per_query(baseline, keys)
+    comparison = []
+    for name, run in runs:
+        init = time.time()
+        _, table = evaluation.per_query(run, keys)
+        tests = significance.compare(baseline_table, table, resamples, seed)
+        end = time.time() - init
+        metrics.observe('compare', end)
+        logger_global.info('%s vs %s: %s queries, %s resamples per test, '
+                           'tested in %s s' % (name, baseline_name, len(keys),
+                                               resamples, str(end)))
+        for j, measure in enumerate(names):
+            row = {'run': name, 'measure': measure}
+            row.update({column: float(values[j])
+                        for column, values in tests.items()})
+            comparison.append(row)
+            logger_global.info('%s %s: %.4f -> %.4f (%+.4f, %d%% CI '
+                               '[%+.4f, %+.4f]), p = %.4f randomization, '
+                               '%.4f bootstrap' %
+                               (name, measure, row['baseline'], row['other'],
+                                row['delta'], significance.CONFIDENCE*100,
+                                row['ci_low'], row['ci_high'],
+                                row['p_randomization'], row['p_bootstrap']))
+    return comparison
+
+
+
+def write_comparison(filepath, comparison):
+    """
+writes the comparison of the runs in csv file
+    """
+    logger_global.info('Writing comparison on file...')
+    columns = ['baseline', 'other', 'delta', 'ci_low', 'ci_high',
+               'p_randomization', 'p_bootstrap']
+    with open(filepath, 'w', newline='') as csv_file:
+        csv_writer = csv.writer(csv_file, delimiter=';')
+        csv_writer.writerow(['run', 'measure'] + columns)
+        for row in comparison:
+            csv_writer.writerow([row['run'], row['measure']] +
+                                [repr(row[column]) for column in columns])
+
+
+
 def read_results(filename):
     """
 reads results from csv file
@@ -75,6 +195,9 @@ returns dictionary:
     init = time.time()
     results = {}
     
+    # a row holds a whole ranking: past the default field limit
+    # (128 KiB) on large collections
+    csv.field_size_limit(2**31 - 1)
     with open(filename,"r") as csv_file:
         csv_reader = csv.reader(csv_file, delimiter=';')
         for row in csv_reader:
@@ -127,74 +250,17 @@ instantiates the logging
 
 
 
-def precision_recall(answers, results):
+def pyplot():
     """
-answers[query key] = array of answer tuples (docnum, score)
-results[query key] = array of results tuples (rank, docnum, sim)
-performance[query_key] = array of performance tuple (precision, recall)
+imports matplotlib on first use, with the Agg backend (files only, no
+display needed)
+returns matplotlib.pyplot
     """
-    performance = {}
-    for query_key, result in results.items():
-        answer = answers[query_key]   
-        performance[query_key] = []
-    
-        n = len(answer)
-        t, p = 1, 0
-        for my_doc in result:
-            my_doc_num = int(my_doc[1].strip())
-            for right_doc in answer:
-                right_doc_num = int(right_doc[0].strip())
-                if my_doc_num == right_doc_num: p += 1
-            performance[query_key].append((p/t, p/n))
-            t += 1
-    
-    return performance        
-        
-    
-def interpolated_precision_recall(performance):
-    """
-interpolates for maximum precision for all queries
-keeps recall domain intact
-    """
-    curve = {}
-    for query_key, result in performance.items():
-        curve[query_key] = []
-        for i in range(len(result)-1):
-            curve[query_key].append(result[i])
-            if result[i+1][0] > result[i][0]:
-                while (curve[query_key][-1][0] < result[i+1][0]):
-                    del curve[query_key][-1]
-                    if len(curve[query_key]) == 0: break
-        curve[query_key].append(result[-1])
-                
-    return curve
-                
-
-
-def eleven_point_curve(performance):
-    """
-1) computes interpolated precision at eleven recall levels
-2) averages over all queries to get eleven-point precision/recall curve
-returns array of tuples (precision, recall)
-    """
-    curve = {}
-    for query_key, pr in performance.items():
-        result = list(pr)
-        curve[query_key] = []
-        curve[query_key].append((result[0][0],0.0))
-        for recall in [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9]:
-            while (result[0][1] < recall) and (len(result) > 1):
-                del result[0]
-            curve[query_key].append((result[0][0],recall))
-        curve[query_key].append((result[-1][0],1.0))
-
-    curve_avg = []    
-    for i in range(0, 11, 1):
-        precision = [pr[i][0] for pr in curve.values()]
-        curve_avg.append((sum(precision) / len(precision), float(i)/10.))
-        
-    
-    return curve_avg
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    plt.style.use('seaborn-whitegrid')
+    return plt
 
 
 
@@ -203,8 +269,7 @@ def show_precision_recall(performance, key, K):
 shows scatter plot for a precision recall curve for one query
 logs precision @ K
     """
-    import matplotlib.pyplot as plt
-    plt.style.use('seaborn-whitegrid')
+    plt = pyplot()
     
     recall = [x[1] for x in performance[key]]
     precision = [x[0] for x in performance[key]]
@@ -245,12 +310,11 @@ logs precision @ K
 #     plt.close()
 # =============================================================================
 
-def show_11_point_curve(curve):
+def show_11_point_curve(curve, filepath='11PointCurve.png'):
     """
-
+plots the eleven-point curve in filepath
     """
-    import matplotlib.pyplot as plt
-    plt.style.use('seaborn-whitegrid')
+    plt = pyplot()
     
     recall = [x[1] for x in curve]
     precision = [x[0] for x in curve]
@@ -259,62 +323,26 @@ def show_11_point_curve(curve):
     plt.ylim(0,1)
     plt.rcParams.update({'font.size': 18})
     plt.plot(recall, precision, color='black')
-    plt.savefig('11PointCurve.png', dpi=100)
+    plt.savefig(filepath, dpi=100)
     plt.close()
 
 
 
-def ndcg(answers, results):
+def show_ndcg(ndcg, filepath='NDCG.png'):
     """
-answers[query key] = array of answer tuples (docnum, score)
-results[query key] = array of results tuples (rank, docnum, sim)
-dcg[query key] = array of dcg values ordered by my document rank
-ndcg[query key] = array of ndcg values ordered by my document rank
-plots dcg and ndcg in bar plots
+ndcg[query key] = nDCG at the last relevant document found
+plots the nDCG of every query in a bar plot in filepath
     """
-    import matplotlib.pyplot as plt
-    plt.style.use('seaborn-whitegrid')
+    plt = pyplot()
     
-    dcg = {}
-    ndcg = {}
-    for query_key, result in results.items():
-        
-        answer = answers[query_key]
-        dcg[query_key] = []
-        icg = []
-        dcg_value = 0.
-        for my_doc in result:
-            my_doc_num = int(my_doc[1].strip())
-            for right_doc in answer:
-                right_doc_num = int(right_doc[0].strip())
-                if my_doc_num == right_doc_num:
-                    relevance = [int(r) for r in list(right_doc[1].strip())]
-                    relevance = sum(relevance)
-                    rank = my_doc[0]
-                    dcg_value += relevance / rank
-                    icg.append(relevance)
-                    dcg[query_key].append(dcg_value)
-        
-        icg.sort(reverse=True)
-        idcg_value = 0.
-        ndcg[query_key] = []
-        i = 1
-        for icg_value in icg:
-            idcg_value += icg_value/i
-            ndcg[query_key].append(dcg[query_key][i-1]/idcg_value)
-            i += 1
-            
     x = list(ndcg.keys())
-    y = [ndcg[key][-1] for key in x]
+    y = [ndcg[key] for key in x]
     plt.figure(figsize=(20,10))
     plt.rcParams.update({'font.size': 18})
     plt.bar(x, y)
     plt.xticks([])
-    plt.savefig('NDCG.png', dpi=100)
+    plt.savefig(filepath, dpi=100)
     plt.close()
-    
-    logger_global.info('Maximum NDCG is '+str(max(y))+' for '+ x[y.index(max(y))])
-    logger_global.info('Minimum NDCG is '+str(min(y))+' for '+ x[y.index(min(y))])
 
 
 def write_performance(filepath, results):
@@ -330,6 +358,7 @@ writes performance in csv file
             csv_writer.writerow([key, row])
     
     end = time.time() - init
+    metrics.observe('write', end)
     logger_global.info('Write operation finished with %s s' % str(end))
 
 
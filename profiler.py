@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 19:48:22 2026
+@author: thabata
+
+profiling hooks per pipeline stage, turned on by the PROFILE= key of each
+module's cfg:
+
+  PROFILE=cpu                   cProfile of every stage
+  PROFILE=mem                   tracemalloc of every stage
+  PROFILE=cpu,mem:score,write   both, only for the named stages
+
+cpu: <log name>_<stage>.prof next to the module's log, in pstats format
+     (python -m pstats, snakeviz, tuna, flameprof for flame graphs)
+mem: <log name>_<stage>_mem.txt, for each run of the stage its peak of
+     traced memory and the top allocation sites (net, by source line)
+a stage run several times (e.g. parse, once per xml file) accumulates into
+one profile; only the calling process is profiled, not pool workers
+
+with LEITURA=STREAM, records are parsed one at a time inside the tokenizing
+loop, and switching the profilers per record would cost more than the work
+itself: parse and tokenize (and, in inverted_index without MEMORIA=, invert)
+are profiled together as the stage 'stream'; in the cpu profile stream_XML
+and the analyzer remain apart by function
+"""
+
+from contextlib import nullcontext
+import cProfile
+import tracemalloc
+import os
+
+MODES = ('cpu', 'mem')
+# allocation sites listed per stage run, and frames kept per allocation
+TOP = 25
+FRAMES = 1
+MB = float(2**20)
+
+
+
+class Profiler:
+    """
+profiles of the stages of one run
+    """
+
+    def __init__(self):
+        self.modes = set()
+        self.stages = None
+        self.prefix = None
+        self.profiles = {}
+        self.reports = {}
+
+
+    def configure(self, log_path, config_vector):
+        """
+reads PROFILE= from the module's configuration; output files are named
+after the module's log
+        """
+        self.prefix = os.path.splitext(log_path)[0]
+        for config in config_vector:
+            if str(config[0]) == 'PROFILE':
+                modes, _, stages = config[1].strip().partition(':')
+                self.modes = {mode.strip().lower()
+                              for mode in modes.split(',')} & set(MODES)
+                self.stages = {stage.strip() for stage in stages.split(',')
+                               if stage.strip()} or None
+
+
+    def enabled(self, name):
+        return bool(self.modes) and (self.stages is None or
+                                     name in self.stages)
+
+
+    def stage(self, name):
+        """
+returns context manager profiling its block as stage name (does nothing
+when the stage isn't profiled)
+stages must not be nested
+        """
+        if not self.enabled(name):
+            return nullcontext()
+        return Stage(self, name)
+
+
+    def finish(self):
+        """
+writes the profiles and stops tracing
+returns array of the files written
+        """
+        written = []
+        for name, profile in self.profiles.items():
+            filepath = '%s_%s.prof' % (self.prefix, name)
+            profile.dump_stats(filepath)
+            written.append(filepath)
+        for name, lines in self.reports.items():
+            filepath = '%s_%s_mem.txt' % (self.prefix, name)
+            with open(filepath, 'w') as report:
+                report.write('\n'.join(lines) + '\n')
+            written.append(filepath)
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.profiles = {}
+        self.reports = {}
+        return written
+
+
+
+class Stage:
+    """
+one run of a profiled stage
+    """
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.before = None
+
+
+    def __enter__(self):
+        if 'mem' in self.profiler.modes:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(FRAMES)
+            self.before = tracemalloc.take_snapshot()
+            tracemalloc.reset_peak()
+            self.start = tracemalloc.get_traced_memory()[0]
+        if 'cpu' in self.profiler.modes:
+            profiles = self.profiler.profiles
+            if self.name not in profiles:
+                profiles[self.name] = cProfile.Profile()
+            profiles[self.name].enable()
+        return self
+
+
+    def __exit__(self, *exc):
+        if 'cpu' in self.profiler.modes:
+            self.profiler.profiles[self.name].disable()
+        if self.before is not None:
+            current, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+            ignore = (tracemalloc.Filter(False, tracemalloc.__file__),
+                      tracemalloc.Filter(False, '<frozen importlib.*>'))
+            stats = after.filter_traces(ignore).compare_to(
+                        self.before.filter_traces(ignore), 'lineno')
+            lines = self.profiler.reports.setdefault(self.name, [])
+            lines.append('run %s of stage %s: peak %.2f MiB, net %+.2f MiB'
+                         % (sum(line.startswith('run ') for line in lines)+1,
+                            self.name, (peak - self.start)/MB,
+                            (current - self.start)/MB))
+            lines += ['  %s' % stat for stat in stats[:TOP]]
+            lines.append('')
+            self.before = None
+
+
+
+# profiler of this process
+current = Profiler()
+configure = current.configure
+stage = current.stage
+finish = current.finish
@@ -5,10 +5,11 @@ Created on Sat Aug 25 09:51:37 2018
 @author: thabata
 """
 
-from nltk.tokenize import word_tokenize
-from nltk.stem.porter import PorterStemmer
-from nltk.corpus import stopwords
+from analyzer import make_analyzer
 from xml.dom.minidom import parse
+from xml.etree.ElementTree import iterparse
+import metrics
+import profiler
 import logging
 import time
 
@@ -25,32 +26,47 @@ calls functions to read queries and outputs
     log('query_processor', log_path)
     logger_global = logging.getLogger('query_processor')
     logger_global.info('Processing Queries Module...')
+    profiler.configure(log_path, config_vector)
 
     queries_array = []
     queries_keys = []
     
-    #stop words
-    stop_words = set(stopwords.words('english'))
-    
     use_mode = config_vector[0][1]
+    read_mode = 'DOM'
+    tokenizer_mode = 'NLTK'
+    for config in config_vector:
+        if str(config[0]) == 'LEITURA':
+            read_mode = config[1].strip()
+        elif str(config[0]) == 'TOKENIZADOR':
+            tokenizer_mode = config[1].strip()
+    
+    #stop words, stemmer and tokenizer shared with inverted_index
+    analyzer = make_analyzer(use_mode, tokenizer_mode)
+
     for config in config_vector:
-        if str(config[0]) == 'LEIA':            
-            partial_qus_array, partial_qus_keys, results = \
+        if str(config[0]) == 'LEIA':
+            # streamed records are parsed while tokenizing
+            if read_mode == 'STREAM':
+                partial_qus_keys = []
+                results = []
+                partial_qus_array = split_records(
+                                    stream_XML(path+str(config[1]).strip()),
+                                    partial_qus_keys,
+                                    results)
+            else:
+                with profiler.stage('parse'):
+                    partial_qus_array, partial_qus_keys, results = \
                                     read_XML(path+str(config[1]).strip())
             
             logger_global.info('Tokenizing documents...')
-            if use_mode == 'STEMMER':
-                stemmer = PorterStemmer()
-                queries_array += tokenizer(partial_qus_array,
-                                              stop_words,
-                                              stemmer)
-                queries_keys += partial_qus_keys
-            elif use_mode == 'NOSTEMMER':
-                queries_array += tokenizer(partial_qus_array,
-                                              stop_words,
-                                              None)
-                queries_keys += partial_qus_keys                
-            else: print("ERROR: Use mode undefined.")
+            # streamed records are parsed inside the tokenizing loop: one
+            # profiler stage, 'stream', for both (see profiler)
+            with profiler.stage('stream' if read_mode == 'STREAM'
+                                else 'tokenize'):
+                if analyzer is not None:
+                    queries_array += tokenizer(partial_qus_array, analyzer)
+                    queries_keys += partial_qus_keys
+                else: print("ERROR: Use mode undefined.")
             
         elif str(config[0]) == 'CONSULTAS':
             outfile_queries = path+config[1].strip()
@@ -72,16 +88,24 @@ calls functions to read queries and outputs
     logger_global.info('All %s queries read and tokenized successfully '
                       'in %s s' % (str(len(queries_array)), str(end)))
     
-    logger_global.info('Writing Queries on file...')
-    write_csv(outfile_queries, queries_keys, queries_array)
-    
-    logger_global.info('Writing Expected Results on file...')
-    write_csv(outfile_expected_results, queries_keys, results)
+    with profiler.stage('write'):
+        logger_global.info('Writing Queries on file...')
+        write_csv(outfile_queries, queries_keys, queries_array)
+        
+        logger_global.info('Writing Expected Results on file...')
+        write_csv(outfile_expected_results, queries_keys, results)
     
     end = time.time() - start
+    metrics.observe('write', end)
     logger_global.info('Write operation finished with %s s' % str(end))
     
     end = time.time() - begin
+    metrics.count('queries', len(queries_keys))
+    metrics.observe('run', end)
+    metrics.export(metrics.metrics_path(path, log_path, config_vector),
+                   {'module': 'query_processor'})
+    for filepath in profiler.finish():
+        logger_global.info('Profile written on '+filepath)
     logger_global.info('End of Query Processor Module. '
                    'Total of %s elapsed.' % str(end))
 
@@ -119,12 +143,66 @@ The results arrays are arrays of tuples: (doc number, votes)
         results.append(result)
     
     finish = time.time() - init
+    metrics.observe('parse', finish)
     logger_global.info('%s queries read succesfully in %s s.' % 
                           (str(len(queries)), str(finish)))
     return queries, queries_keys, results
 
 
 
+def stream_XML(filename):
+    """
+reads data from xml files incrementally, one QUERY at a time
+yields tuples: (query key, query text, results array)
+The results arrays are arrays of tuples: (doc number, votes)
+each QUERY is cleared once read, so memory doesn't grow with the file size
+the parse time only counts the steps of this generator, not the consumer's
+work between queries (and tokenizing leaves the steps out, see tokenizer)
+    """
+    logger_global.info('Streaming '+filename+' file...')
+    init = time.time()
+    
+    parsing = 0.
+    n_queries = 0
+    root = None
+    step = time.perf_counter()
+    for event, elem in iterparse(filename, events=('start', 'end')):
+        if root is None:
+            root = elem
+        if event != 'end' or elem.tag != 'QUERY':
+            continue
+        
+        qu_num = elem.findtext('QueryNumber')
+        text = elem.findtext('QueryText')
+        result = [(item.text, item.get('score'))
+                  for item in elem.find('Records').iter('Item')]
+        elem.clear()
+        root.clear()
+        n_queries += 1
+        parsing += time.perf_counter() - step
+        yield qu_num, text, result
+        step = time.perf_counter()
+    
+    parsing += time.perf_counter() - step
+    finish = time.time() - init
+    metrics.observe('parse', parsing)
+    logger_global.info('%s queries read succesfully in %s s (%s s parsing).'
+                       % (str(n_queries), str(finish), str(parsing)))
+
+
+
+def split_records(records, queries_keys, results):
+    """
+unzips (query key, query text, results array) tuples on the fly
+appends keys and results to the given arrays and yields texts
+    """
+    for key, text, result in records:
+        queries_keys.append(key)
+        results.append(result)
+        yield text
+
+
+
 def log(name, log_file):
     """
 instantiates the logging
@@ -146,30 +224,27 @@ instantiates the logging
 
 
 
-def tokenizer(docs, stop, stemmer):
+def tokenizer(docs, analyzer):
     """
-tokenize documents and pre-process
+tokenize documents and pre-process with the shared analyzer
 - with stemmer (or not)
 - removes small words (1-2 chars)
 - removes numbers
+the time spent reading docs (streamed records are parsed on demand) is left
+out, it is the parse stage's
 returns array of arrays (list of tokens in each document)
     """
     init = time.time()
-    import re
-    regex = re.compile('^\d*[.,]?\d*$')
     
-    tok_docs = []
-    for doc in docs:
-        toks = [stemmer.stem(tok) for tok in word_tokenize(doc)
-                                        if not tok in stop
-                                        if len(tok)>2
-                                        if regex.match(tok)==None]
-        toks = [tok.upper() for tok in toks]
-        tok_docs.append(toks)
+    reading = metrics.Stopwatch()
+    tok_docs = analyzer.analyze_all(reading.pull(docs))
 
-    finish = time.time() - init
+    finish = time.time() - init - reading.elapsed
+    metrics.observe('tokenize', finish)
     logger_global.info('%s records tokenized succesfully in %s s.' % 
-                          (str(len(docs)), str(finish)))
+                          (str(len(tok_docs)), str(finish)))
+    for line in analyzer.report():
+        logger_global.info('Analyzer '+line)
 
     return tok_docs
 
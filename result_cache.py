@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 17:25:40 2026
+@author: thabata
+
+query result cache for the searcher: LRU over the analyzed query tokens
+(+ k), bound to one model signature (model files stat + index generation),
+so results from an older model are never served
+"""
+
+from collections import OrderedDict
+import os
+
+
+
+def query_key(query, topk=0):
+    """
+query: dictionary of query tokens -> weights (see calculate_queries_tfidf)
+the key doesn't depend on token order or on the query number
+returns tuple
+    """
+    return (tuple(sorted((token, weight) for token, weight in query.items()
+                         if token != 'qu keys')), topk)
+
+
+
+def model_signature(filenames, generation=0):
+    """
+returns tuple identifying the current version of the model files
+    """
+    signature = []
+    for filename in filenames:
+        stat = os.stat(filename)
+        # the inode changes when the file is replaced (atomic writes)
+        signature.append((filename, stat.st_ino, stat.st_mtime_ns,
+                          stat.st_size))
+    return tuple(signature), generation
+
+
+
+class ResultCache:
+    """
+bounded LRU cache of ranked results
+bind() must be called with the model signature before each use: a new
+signature empties the cache
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.signature = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+    def bind(self, signature):
+        if signature != self.signature:
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+            self.signature = signature
+
+
+    def get(self, key):
+        """
+returns the cached result, or None
+        """
+        try:
+            result = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return result
+
+
+    def put(self, key, result):
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+
+    def report(self):
+        lookups = self.hits + self.misses
+        return ('result cache: %s hits, %s misses (%.1f%% hit rate), '
+                '%s entries, %s invalidations' %
+                (self.hits, self.misses,
+                 100.*self.hits/lookups if lookups else 0.,
+                 len(self.entries), self.invalidations))
@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 18:02:14 2026
+@author: thabata
+
+resident search service: loads the model once and answers queries over HTTP
+(asyncio), analyzing them like query_processor; concurrent requests are
+scored together in micro-batches (LOTE strategy of the searcher)
+
+  GET  /search?q=<text>&k=<top k>     ranked results as JSON
+  POST /search  {"q": text, "k": k}   same
+  POST /search  {"tokens": [...], "k": k}  query already analyzed (e.g. a
+                                      row of queries_out.csv)
+  GET  /health                        model and cache state as JSON
+  GET  /metrics                       Prometheus text (see metrics)
+
+the model is mapped again (and the result cache emptied) when its file
+changes
+"""
+
+from analyzer import make_analyzer
+from result_cache import ResultCache, model_signature
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import urlsplit, parse_qs
+import searcher
+import metrics
+import asyncio
+import json
+import logging
+import time
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+           405: 'Method Not Allowed', 500: 'Internal Server Error'}
+# largest k a request may ask for
+MAX_TOPK = 1000
+
+def search_server(path, config_vector):
+    """
+reads the configuration, loads analyzer and model, and serves forever
+    """
+    global logger_global
+    log_path = path+'/5-SEARCHER/ss.log'
+    level = logging.INFO
+    for config in config_vector:
+        if str(config[0]) == 'NIVEL_LOG':
+            level = getattr(logging, config[1].strip().upper(), logging.INFO)
+    log('search_server', log_path, level)
+    logger_global = logging.getLogger('search_server')
+    logger_global.info('Starting Search Server...')
+    # the searcher functions log through their module logger; their
+    # per-batch lines only in debug
+    searcher.logger_global = logging.getLogger('search_server.searcher')
+    searcher.logger_global.setLevel(logging.DEBUG if level == logging.DEBUG
+                                    else logging.WARNING)
+
+    use_mode = config_vector[0][1]
+    tokenizer_mode = 'NLTK'
+    host, port = '127.0.0.1', 8080
+    topk = 10
+    cache_size = 0
+    max_batch = 64
+    window = 0.
+    for config in config_vector:
+        if str(config[0]) == 'TOKENIZADOR':
+            tokenizer_mode = config[1].strip()
+        elif str(config[0]) == 'MODELO':
+            model_path = searcher.model_file(path+config[1].strip())
+        elif str(config[0]) == 'TOPK':
+            topk = int(config[1])
+        elif str(config[0]) == 'CACHE':
+            cache_size = int(config[1])
+        elif str(config[0]) == 'ENDERECO':
+            host = config[1].strip()
+        elif str(config[0]) == 'PORTA':
+            port = int(config[1])
+        elif str(config[0]) == 'LOTE':
+            max_batch = int(config[1])
+        elif str(config[0]) == 'JANELA':
+            window = float(config[1])/1000.
+
+    analyzer = make_analyzer(use_mode, tokenizer_mode)
+    if analyzer is None:
+        print("ERROR: Use mode undefined.")
+        return
+
+    server = SearchServer(model_path, analyzer, topk, cache_size,
+                          max_batch, window)
+    try:
+        asyncio.run(server.serve(host, port))
+    except KeyboardInterrupt:
+        logger_global.info('Search Server stopped. '+server.report())
+    finally:
+        server.count_cache()
+        metrics.export(metrics.metrics_path(path, log_path, config_vector),
+                       {'module': 'search_server'})
+
+
+
+class SearchServer:
+    """
+the model is only touched by the single scoring thread, so a reload never
+races with a batch
+max_batch: most queries scored in one call
+window: seconds to wait for more requests before scoring a batch (0: only
+what arrived while the previous batch was being scored)
+    """
+
+    def __init__(self, model_path, analyzer, topk=10, cache_size=0,
+                 max_batch=64, window=0.):
+        self.model_path = model_path
+        self.analyzer = analyzer
+        self.topk = topk
+        self.cache = ResultCache(cache_size) if cache_size else None
+        self.max_batch = max_batch
+        self.window = window
+        self.scorer = ThreadPoolExecutor(max_workers=1)
+        self.model = None
+        self.files = None
+        self.queries = 0
+        self.batches = 0
+        self.load()
+
+
+    def load(self):
+        """
+(re)loads the model when its file changed since the last load
+        """
+        files, _ = model_signature([self.model_path])
+        if files == self.files:
+            return
+        self.model = searcher.read_any_model(self.model_path)
+        self.files = files
+        logger_global.info('Model %s loaded: %s documents, %s tokens, '
+                           'generation %s' % (self.model_path,
+                                              self.model.n_docs,
+                                              self.model.n_terms,
+                                              self.model.generation))
+        if self.cache is not None:
+            self.cache.bind(model_signature([self.model_path],
+                                            self.model.generation))
+
+
+    async def serve(self, host, port):
+        self.pending = asyncio.Queue()
+        batcher = asyncio.create_task(self.batcher())
+        server = await asyncio.start_server(self.handle, host, port)
+        logger_global.info('Listening on http://%s:%s/search' % (host, port))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+
+    async def search(self, text, topk, tokens=None):
+        """
+analyzes one query (unless its tokens are given) and waits for its batch to
+be scored
+the analysis runs in the scoring thread, off the event loop: a long query
+doesn't hold up the other connections, and the analyzer (its stem cache)
+is only used from one thread
+returns tuple: (tokens, array of ordered tuples (rank, doc, similarity))
+        """
+        loop = asyncio.get_running_loop()
+        if tokens is None:
+            tokens = await loop.run_in_executor(self.scorer,
+                                                self.analyzer.analyze, text)
+        future = loop.create_future()
+        await self.pending.put((tokens, topk, future))
+        return tokens, await future
+
+
+    async def batcher(self):
+        """
+collects pending queries into batches and scores them in the scoring
+thread, one batch at a time
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.pending.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.pending.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.pending.get(),
+                                                        timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                results = await loop.run_in_executor(self.scorer,
+                                                     self.score, batch)
+            except Exception as error:
+                logger_global.exception('Batch failed')
+                for _, _, future in batch:
+                    if not future.done(): future.set_exception(error)
+                continue
+            for (_, _, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+
+    def score(self, batch):
+        """
+runs in the scoring thread: one LOTE call per distinct k in the batch
+returns array of results, in batch order; the queries of a k whose call
+failed get the exception instead, the other queries of the batch are not
+affected
+        """
+        self.load()
+        self.queries += len(batch)
+        self.batches += 1
+        metrics.count('queries', len(batch))
+        metrics.count('batches')
+        results = [None] * len(batch)
+        for topk in {item[1] for item in batch}:
+            positions = [i for i, item in enumerate(batch)
+                         if item[1] == topk]
+            queries = []
+            for i in positions:
+                query = {'qu keys': str(i)}
+                for token in batch[i][0]:
+                    query[token] = 1.
+                queries.append(query)
+            search = partial(searcher.cosine_similarity, self.model,
+                             strategy='LOTE', topk=topk)
+            try:
+                if self.cache is not None:
+                    similarities = searcher.cached_similarity(
+                                        self.cache, search, queries, topk)
+                else:
+                    similarities = search(queries)
+            except Exception as error:
+                logger_global.exception('Scoring %s queries with k=%s '
+                                        'failed' % (len(positions), topk))
+                metrics.count('failed_queries', len(positions))
+                for i in positions:
+                    results[i] = error
+                continue
+            for i, (_, result) in zip(positions, similarities):
+                results[i] = result
+        return results
+
+
+    async def handle(self, reader, writer):
+        """
+serves the HTTP/1.1 requests of one connection (keep-alive)
+every request gets a response: 400 (and the connection closed) when it
+can't be parsed, 500 when it fails
+        """
+        try:
+            while True:
+                request = await reader.readline()
+                if not request:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    method, target, _ = \
+                                request.decode('latin-1').split(' ', 2)
+                    length = int(headers.get('content-length', 0))
+                    if length < 0:
+                        raise ValueError(length)
+                except ValueError:
+                    # the rest of the stream can't be framed: answer, close
+                    headers['connection'] = 'close'
+                    status, payload = 400, {'error': 'malformed request'}
+                else:
+                    body = await reader.readexactly(length)
+                    with metrics.timer('request'):
+                        try:
+                            status, payload = await self.route(method,
+                                                               target, body)
+                        except Exception:
+                            logger_global.exception('Request %s %s failed' %
+                                                    (method, target))
+                            status, payload = 500, {'error': 'internal error'}
+                if isinstance(payload, str):
+                    content_type = 'text/plain; version=0.0.4'
+                    data = payload.encode('utf-8')
+                else:
+                    content_type = 'application/json'
+                    data = json.dumps(payload).encode('utf-8')
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(('HTTP/1.1 %s %s\r\n'
+                              'Content-Type: %s\r\n'
+                              'Content-Length: %s\r\n'
+                              'Connection: %s\r\n\r\n' %
+                              (status, REASONS[status], content_type,
+                               len(data),
+                               'keep-alive' if keep_alive else 'close')
+                              ).encode('latin-1') + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+    async def route(self, method, target, body):
+        """
+returns tuple: (HTTP status, JSON payload or text)
+        """
+        url = urlsplit(target)
+        if url.path == '/metrics':
+            self.count_cache()
+            return 200, metrics.registry.prometheus({'module':
+                                                     'search_server'})
+        if url.path == '/health':
+            cache = self.cache.report() if self.cache is not None else None
+            return 200, {'documents': self.model.n_docs,
+                         'terms': self.model.n_terms,
+                         'generation': self.model.generation,
+                         'queries': self.queries,
+                         'batches': self.batches,
+                         'cache': cache}
+        if url.path != '/search':
+            return 404, {'error': 'unknown path '+url.path}
+
+        if method == 'GET':
+            params = {key: values[0]
+                      for key, values in parse_qs(url.query).items()}
+        elif method == 'POST':
+            try: params = json.loads(body or b'{}')
+            except ValueError: return 400, {'error': 'invalid JSON body'}
+            if not isinstance(params, dict):
+                return 400, {'error': 'JSON body must be an object'}
+        else:
+            return 405, {'error': 'use GET or POST'}
+        if not isinstance(params.get('q', ''), str):
+            return 400, {'error': 'q must be a string'}
+        tokens = params.get('tokens')
+        if tokens is not None and not (isinstance(tokens, list) and
+                                       all(isinstance(token, str)
+                                           for token in tokens)):
+            return 400, {'error': 'tokens must be a list of strings'}
+        if not (params.get('q') or tokens):
+            return 400, {'error': 'missing query text (q) or tokens'}
+
+        topk = params.get('k', self.topk)
+        try:
+            if isinstance(topk, (bool, float)):
+                raise ValueError(topk)
+            topk = int(topk)
+        except (TypeError, ValueError):
+            return 400, {'error': 'k must be an integer'}
+        if not 0 < topk <= MAX_TOPK:
+            return 400, {'error': 'k must be between 1 and %s' % MAX_TOPK}
+
+        init = time.perf_counter()
+        try:
+            tokens, result = await self.search(params.get('q'), topk,
+                                               tokens)
+        except Exception as error:
+            return 500, {'error': 'search failed: %s' % error}
+        return 200, {'query': params.get('q', ''),
+                     'tokens': tokens,
+                     'k': topk,
+                     'results': [{'rank': rank, 'doc': doc, 'score': simil}
+                                 for rank, doc, simil in result],
+                     'took_ms': (time.perf_counter() - init) * 1000.}
+
+
+    def count_cache(self):
+        """
+copies the result cache counters into the metrics
+        """
+        if self.cache is not None:
+            metrics.registry.counters['cache_hits'] = self.cache.hits
+            metrics.registry.counters['cache_misses'] = self.cache.misses
+
+
+    def report(self):
+        line = '%s queries in %s batches' % (self.queries, self.batches)
+        if self.cache is not None:
+            line += ', '+self.cache.report()
+        return line
+
+
+
+def log(name, log_file, level=logging.INFO):
+    """
+instantiates the logging
+level: logging.DEBUG also writes the per-batch lines of the searcher
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    # create a file handler
+    handler = logging.FileHandler(log_file)
+    handler.setLevel(level)
+    # create a logging format
+    formatter = logging.Formatter(
+                    '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    handler.setFormatter(formatter)
+    streamHandler = logging.StreamHandler()
+    streamHandler.setFormatter(formatter)
+    # add the handlers to the logger
+    logger.addHandler(handler)
+    logger.addHandler(streamHandler)
+
+
+
+if __name__ == '__main__':
+
+    import os
+    PATH = os.path.dirname(os.path.abspath(__file__))
+
+    config_file = '/5-SEARCHER/ss.cfg'
+
+    with open(PATH+config_file.strip(), 'r') as configuration:
+        config_vector=[]
+        for line in configuration:
+            line = line.strip()
+            config_vector.append(line.split('='))
+
+    search_server(PATH, config_vector)
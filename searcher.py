@@ -5,11 +5,19 @@ Created on Sat Aug 25 14:54:15 2018
 @author: thabata
 """
 import csv
+import os
 from math import sqrt
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import chain, islice
+import heapq
+import numpy as np
+import binary_model
+import metrics
+import profiler
+from result_cache import ResultCache, query_key, model_signature
 import logging
 import time
-import matplotlib.pyplot as plt
-plt.style.use('seaborn-whitegrid')
 
 def searcher(path, config_vector):
     """
@@ -21,34 +29,95 @@ calls functions to read inverted index and creates TF.IDF matrix
     #instantiate logging 
     global logger_global
     log_path = path+'/5-SEARCHER/se.log'
-    log('searcher', log_path)
+    level = logging.INFO
+    for config in config_vector:
+        if str(config[0]) == 'NIVEL_LOG':
+            level = getattr(logging, config[1].strip().upper(), logging.INFO)
+    log('searcher', log_path, level)
     logger_global = logging.getLogger('searcher')
     logger_global.info('Processing Searcher Module...')
-
+    profiler.configure(log_path, config_vector)
+
+    outfile_results = 0
+    strategy = 'ACUMULADORES'
+    topk = 0
+    workers = 1
+    cache_size = 0
+    models = []
     for config in config_vector:
-        if str(config[0]) == 'MODELO':            
-            doc_tfidf = read_TFIDF(path+config[1].strip())
+        if str(config[0]) == 'MODELO':
+            models.append(model_file(path+config[1].strip()))
         
         elif str(config[0]) == 'CONSULTAS':            
-            queries = read_QUERIES(path+config[1].strip())
+            with profiler.stage('load'):
+                queries = read_QUERIES(path+config[1].strip())
             
         elif str(config[0]) == 'RESULTADOS':
             outfile_results = path+config[1]
+            
+        elif str(config[0]) == 'ESTRATEGIA':
+            strategy = config[1].strip()
+            
+        elif str(config[0]) == 'TOPK':
+            topk = int(config[1])
+            
+        elif str(config[0]) == 'WORKERS':
+            workers = int(config[1])
+            
+        elif str(config[0]) == 'CACHE':
+            cache_size = int(config[1])
+    
+    if strategy not in STRATEGIES:
+        logger_global.warning('Undefined strategy '+strategy+'. '
+                              'Applying default: ACUMULADORES')
+        strategy = 'ACUMULADORES'
     
     if not outfile_results:
         outfile_results = path+'/5-SEARCHER/results.csv'
         logger_global.warning('Outfile not specified. '
                              'Applying default: '+outfile_results)
+    
+    # one MODELO: the whole collection; several: one per document shard
+    if len(models) == 1:
+        with profiler.stage('load'):
+            doc_tfidf = read_any_model(models[0])
 
     end = time.time() - begin
     logger_global.info('Documents and queries read succesfully '
                       'in %s s' % str(end))
     
-    similarities = cosine_similarity(doc_tfidf,
-                                     calculate_queries_tfidf(queries))
-    write_results(outfile_results, similarities)
+    if len(models) == 1:
+        search = partial(cosine_similarity, doc_tfidf, strategy=strategy,
+                         topk=topk, workers=workers)
+        signature = model_signature(models, doc_tfidf.generation)
+    else:
+        search = partial(sharded_cosine_similarity, models,
+                         strategy=strategy, topk=topk)
+        signature = model_signature(models)
+    
+    with profiler.stage('score'):
+        if cache_size:
+            cache = ResultCache(cache_size)
+            cache.bind(signature)
+            similarities = cached_similarity(cache, search,
+                                             calculate_queries_tfidf(queries),
+                                             topk)
+        else:
+            similarities = search(calculate_queries_tfidf(queries))
+    if cache_size:
+        logger_global.info(cache.report())
+        metrics.count('cache_hits', cache.hits)
+        metrics.count('cache_misses', cache.misses)
+    with profiler.stage('write'):
+        write_results(outfile_results, similarities)
 
     end = time.time() - begin
+    metrics.count('queries', len(queries))
+    metrics.observe('run', end)
+    metrics.export(metrics.metrics_path(path, log_path, config_vector),
+                   {'module': 'searcher'})
+    for filepath in profiler.finish():
+        logger_global.info('Profile written on '+filepath)
     logger_global.info('End of Searcher Module. '
                    'Total of %s elapsed.' % str(end))
 
@@ -56,28 +125,92 @@ calls functions to read inverted index and creates TF.IDF matrix
 
 def read_TFIDF(filename):
     """
-reads tfidf matrix from csv file
-returns TFIDF array of dictionaries:
-    [ {tfidf['doc keys'], tfidf[token1], tfidf[token2], ...} , {}, ... ]
+reads tfidf matrix from csv file into the same flat arrays as the binary
+model (see binary_model)
+the document norm comes from the third column written by the indexer, or is
+calculated here once for models without it
+returns Model
     """
     import ast
     logger_global.info('Reading '+filename+' file...')
     init = time.time()
-    tfidf = []
+    docs = []
+    terms = {}
+    indptr = [0]
+    indices = []
+    data = []
+    norms = []
     
     with open(filename,"r") as csv_file:
-        csv_reader = list(csv.reader(csv_file, delimiter=';'))
+        csv_reader = csv.reader(csv_file, delimiter=';')
         for row in csv_reader:
-            tfidf_dict = {}
-            tfidf_dict['doc keys'] = row[0]
-            for pair in ast.literal_eval(row[1]):
-                tfidf_dict[pair[0]] = pair[1]
-            tfidf.append(tfidf_dict)
-    logger_global.info('TFIDF matrix read in %s s' % str(time.time()-init))
+            docs.append(row[0])
+            weights = []
+            for token, weight in ast.literal_eval(row[1]):
+                try: term_id = terms[token]
+                except KeyError: term_id = terms[token] = len(terms)
+                indices.append(term_id)
+                weights.append(float(weight))
+            data += weights
+            indptr.append(len(indices))
+            if len(row) > 2:
+                norms.append(float(row[2]))
+            else:
+                norms.append(document_norm(weights))
+    
+    tfidf = binary_model.from_arrays(docs, list(terms), indptr, indices,
+                                     data, norms)
+    end = time.time() - init
+    metrics.observe('load', end)
+    logger_global.info('TFIDF matrix read in %s s' % str(end))
+    return tfidf
+
+
+
+def read_model(filename):
+    """
+memory-maps the binary model written by the indexer (no parsing)
+returns Model
+    """
+    logger_global.info('Reading '+filename+' file...')
+    init = time.time()
+    tfidf = binary_model.load_model(filename)
+    end = time.time() - init
+    metrics.observe('load', end)
+    logger_global.info('TFIDF model mapped in %s s: %s documents, %s tokens, '
+                       'generation %s' % (str(end), tfidf.n_docs,
+                                          tfidf.n_terms, tfidf.generation))
     return tfidf
 
 
 
+def model_file(filename):
+    """
+the binary model (.mdl) is not kept in the repository: until the indexer
+has written it, the csv model next to it is read instead
+returns the model file to read
+    """
+    fallback = filename[:-len('.mdl')]+'.csv'
+    if filename.endswith('.mdl') and not os.path.exists(filename) and \
+       os.path.exists(fallback):
+        logger_global.warning('Model '+filename+' not found (run the '
+                              'indexer to write it). Reading '+fallback)
+        return fallback
+    return filename
+
+
+
+def read_any_model(filename):
+    """
+reads a binary (.mdl) or csv model
+returns Model
+    """
+    if filename.endswith('.mdl'):
+        return read_model(filename)
+    return read_TFIDF(filename)
+
+
+
 def read_QUERIES(filename):
     """
 reads queries from csv file
@@ -93,20 +226,23 @@ returns dictionary: queries[query key] = array of tokenized query
         for row in csv_reader:
             queries[row[0]] = ast.literal_eval(row[1])
 
-    logger_global.info('Queries file read in %s s' % str(time.time()-init))
+    end = time.time() - init
+    metrics.observe('load_queries', end)
+    logger_global.info('Queries file read in %s s' % str(end))
     return queries
 
 
 
-def log(name, log_file):
+def log(name, log_file, level=logging.INFO):
     """
 instantiates the logging
+level: logging.DEBUG also writes the per-query lines
     """
     logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)
+    logger.setLevel(level)
     # create a file handler
     handler = logging.FileHandler(log_file)
-    handler.setLevel(logging.INFO)
+    handler.setLevel(level)
     # create a logging format
     formatter = logging.Formatter(
                     '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -144,84 +280,593 @@ returns array of dictionaries:
 
 
 
-def denominator(document, query):
+def document_norm(weights):
+    """
+calculates the norm of a document tfidf
+    """
+    norm = 0.
+    for weight in weights:
+        norm += weight * weight
+    return sqrt(norm)
+
+
+
+def query_vector(doc_tfidf, query):
+    """
+looks the query tokens up in the model
+returns array of term ids, array of query weights (unknown tokens dropped)
+    """
+    term_ids = []
+    weights = []
+    for token, weight in query.items():
+        if token == 'qu keys': continue
+        term_id = doc_tfidf.term_id(token)
+        if term_id >= 0:
+            term_ids.append(term_id)
+            weights.append(float(weight))
+    return term_ids, weights
+
+
+
+def exhaustive_scores(doc_tfidf, term_ids, weights, topk=0):
     """
-calculates the norms of doc and query tfidf's
-returns the denominator for the cosine similarity equation
+scans every entry of the model: the entries of the query terms are picked
+with a mask and summed per document
+returns tuple: (documents having a query term, their numerator array,
+their squared query norm array)
     """
-    document_norm = 0.
-    for key, item in document.items():
-        if key != 'doc keys': document_norm += float(item) * float(item)
-    document_norm = sqrt(document_norm)
+    query_weights = np.zeros(doc_tfidf.n_terms)
+    query_weights[term_ids] = weights
+    hit = np.flatnonzero(query_weights[doc_tfidf.indices])
+    rows = doc_tfidf.rows()[hit]
+    qw = query_weights[doc_tfidf.indices[hit]]
     
-    query_norm = 0.
-    for key, item in query.items():
-        if key in list(document.keys()):
-            query_norm += float(item) * float(item)
-    query_norm = sqrt(query_norm)
+    numerator = np.bincount(rows, weights=doc_tfidf.data[hit] * qw,
+                            minlength=doc_tfidf.n_docs)
+    query_norm = np.bincount(rows, weights=qw * qw,
+                             minlength=doc_tfidf.n_docs)
+    docs = np.flatnonzero(query_norm)
+    return docs, numerator[docs], query_norm[docs]
+
+
+
+def accumulator_scores(doc_tfidf, term_ids, weights, topk=0):
+    """
+term-at-a-time: walks only the postings of the query terms, accumulating
+numerator and squared query norm for the documents they touch
+returns tuple: (touched docs, numerator array, squared query norm array)
+    """
+    postptr = doc_tfidf.postptr
+    spans = [doc_tfidf.postings[postptr[t]:postptr[t+1]] for t in term_ids]
+    if not spans:
+        return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0)
+    return accumulate(doc_tfidf, np.concatenate(spans),
+                      np.repeat(np.asarray(weights),
+                                [len(span) for span in spans]))
+
+
+
+def accumulate(doc_tfidf, entries, qw):
+    """
+sums model entries (with their query weights) per document, in model entry
+order, so each document sums its terms in the same order as the exhaustive
+scan (same floats)
+returns tuple: (documents, numerator array, squared query norm array)
+    """
+    order = np.argsort(entries, kind='stable')
+    entries = entries[order]
+    qw = qw[order]
     
-    return document_norm * query_norm
+    rows = doc_tfidf.rows()[entries]
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = rows[1:] != rows[:-1]
+    accumulator = np.cumsum(first) - 1
+    numerator = np.bincount(accumulator, weights=doc_tfidf.data[entries] * qw)
+    query_norm = np.bincount(accumulator, weights=qw * qw)
+    return rows[first], numerator, query_norm
 
 
 
-def cosine_similarity_minion(doc_tfidf, query):
+def lookup_entries(doc_tfidf, docs, term_ids, weights):
     """
-actually calculates cosine similarity
-returns array of ordered tuples: (rank, doc number, similarity)
+finds the entries of the query terms in the given documents (sorted row
+numbers) by binary search of each document's entry range in the term
+postings, without walking the postings
+returns tuple: (entry numbers array, query weight of each entry)
     """
-    init = time.time()
-    logger_global.info('... for query '+query['qu keys'])
-    similarity = {}
-    no_match = []
-    for document in doc_tfidf:
-        doc_num = document['doc keys']
-        numerator = 0.
-        for token, _ in document.items():
-            try: numerator += float(document[token]) * query[token]
-            except KeyError: pass
-        
-        try: similarity[doc_num] = numerator/denominator(document, query)
-        except ZeroDivisionError:
-            similarity[doc_num] = 0.
-            no_match.append(document['doc keys'])
-    
-    logger_global.warning('... has nothing in common with ' + \
-                          str(len(no_match)) + ' documents')
-     
-    ranked_similarity = sorted(similarity.items(),
-                               key = lambda x: x[1],
-                               reverse=True)
-    
-    result = []
-    for rank in range(len(ranked_similarity)):
-        result.append((rank+1,
-                       ranked_similarity[rank][0],
-                       ranked_similarity[rank][1]))
+    starts = doc_tfidf.indptr[docs]
+    ends = doc_tfidf.indptr[docs+1]
+    found = [np.zeros(0, dtype=np.int64)]
+    found_weights = [np.zeros(0)]
+    for term_id, weight in zip(term_ids, weights):
+        postings = doc_tfidf.postings[doc_tfidf.postptr[term_id]:
+                                      doc_tfidf.postptr[term_id+1]]
+        if len(postings) == 0: continue
+        position = np.searchsorted(postings, starts)
+        entries = postings[np.minimum(position, len(postings)-1)]
+        hit = (position < len(postings)) & (entries < ends)
+        found.append(entries[hit])
+        found_weights.append(np.full(np.count_nonzero(hit), weight))
+    return np.concatenate(found), np.concatenate(found_weights)
+
+
+
+def maxscore_bound(bounds, weights):
+    """
+upper bound of the cosine similarity of a document that only has terms
+from a set, given each term's bound (max weight / doc norm) and query weight
+equal query weights: max over m of (sum of the m largest bounds) / sqrt(m);
+otherwise sqrt(sum of squared bounds) (Cauchy-Schwarz)
+    """
+    if len(bounds) == 0:
+        return 0.
+    if min(weights) == max(weights):
+        best = np.cumsum(np.sort(bounds)[::-1])
+        return float(np.max(best / np.sqrt(np.arange(1, len(best)+1))))
+    return float(np.sqrt(np.sum(np.square(bounds))))
+
+
+
+# relative slack on the bounds, against rounding in the exact scores
+MAXSCORE_SLACK = 1e-9
+
+def maxscore_scores(doc_tfidf, term_ids, weights, topk=0):
+    """
+MaxScore dynamic pruning for top k queries: terms are taken by decreasing
+bound; the documents of the essential terms are scored exactly (their
+other terms found by lookup_entries) and the k-th best similarity so far
+becomes the threshold; the remaining terms whose bounds together cannot
+reach the threshold are non-essential, and documents having only
+non-essential terms are never scored; rounds go on until every essential
+term has been walked
+candidates and scored documents are sorted sparse sets (no per-document
+arrays), so a round costs its postings and lookups, not the collection size
+same top k as the other scorers; without topk it is ACUMULADORES
+not a speedup here: the bounds of cosine weights are loose, so half or more
+of the postings stay essential and the lookups cost more than the walk
+they save (CF: 0.8 ms per query against 0.2 ms, 100x CF: 14 ms against
+8 ms, k = 10); it scores fewer documents, ACUMULADORES is the fast one
+returns tuple: (scored docs, numerator array, squared query norm array)
+    """
+    if not topk or not term_ids:
+        return accumulator_scores(doc_tfidf, term_ids, weights)
+    
+    bounds = doc_tfidf.bounds[term_ids]
+    order = np.argsort(-bounds, kind='stable').tolist()
+    term_ids = [term_ids[i] for i in order]
+    weights = np.asarray(weights)[order]
+    bounds = bounds[order]
+    
+    rows = doc_tfidf.rows()
+    postptr = doc_tfidf.postptr
+    # documents scored so far (sorted) and the results of each round
+    scored = np.zeros(0, dtype=np.int64)
+    rounds = []
+    top = np.zeros(0)
+    essential = 1
+    walked = 0
+    while walked < essential:
+        # walks every newly essential term in one round; their documents
+        # not scored yet have none of the terms walked before, and the
+        # non-essential terms are looked up in those documents only
+        spans = [doc_tfidf.postings[postptr[t]:postptr[t+1]]
+                 for t in term_ids[walked:essential]]
+        entries = np.concatenate(spans)
+        qw = np.repeat(weights[walked:essential], [len(p) for p in spans])
+        entry_rows = rows[entries]
+        if len(scored):
+            position = np.minimum(np.searchsorted(scored, entry_rows),
+                                  len(scored)-1)
+            fresh = scored[position] != entry_rows
+            entries = entries[fresh]
+            qw = qw[fresh]
+            entry_rows = entry_rows[fresh]
+        # each span is in document order: merging the sorted runs is cheap
+        candidates = np.sort(entry_rows, kind='stable')
+        distinct = np.ones(len(candidates), dtype=bool)
+        distinct[1:] = candidates[1:] != candidates[:-1]
+        candidates = candidates[distinct]
+        looked, looked_qw = lookup_entries(doc_tfidf, candidates,
+                                           term_ids[essential:],
+                                           weights[essential:])
+        new, num, qn = accumulate(doc_tfidf,
+                                  np.concatenate([entries, looked]),
+                                  np.concatenate([qw, looked_qw]))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            simil = np.nan_to_num(num / (doc_tfidf.norms[new] * np.sqrt(qn)))
+        rounds.append((new, num, qn))
+        scored = np.sort(np.concatenate([scored, new]), kind='stable')
+        walked = essential
         
-    logger_global.info('finished in %s s' % str(time.time() - init))
+        # the k best similarities so far: the threshold is the k-th
+        top = np.concatenate([top, simil[simil > 0]])
+        if len(top) > topk:
+            top = np.partition(top, len(top)-topk)[-topk:]
+        threshold = top.min() if len(top) == topk else 0.
+        while essential < len(term_ids) and \
+              maxscore_bound(bounds[essential:], weights[essential:]) * \
+              (1 + MAXSCORE_SLACK) >= threshold:
+            essential += 1
+    
+    logger_global.debug('... MaxScore: %s of %s terms essential, %s documents '
+                        'scored', essential, len(term_ids), len(scored))
+    if len(rounds) == 1:
+        return rounds[0]
+    docs, numerator, query_norm = (np.concatenate(r) for r in zip(*rounds))
+    order = np.argsort(docs)
+    return docs[order], numerator[order], query_norm[order]
+
+
+
+SCORERS = {'EXAUSTIVA': exhaustive_scores,
+           'ACUMULADORES': accumulator_scores,
+           'MAXSCORE': maxscore_scores}
+
+STRATEGIES = list(SCORERS) + ['LOTE']
+
+# queries scored together by the LOTE strategy
+BATCH_SIZE = 64
+
+
+
+def batch_scores(doc_tfidf, vectors):
+    """
+scores a batch of queries at once, as the sparse product of the
+queries x terms matrix by the terms x docs postings: every (query term,
+posting) pair is expanded, sorted by (query, model entry) and summed per
+(query, document) with bincount, in the same order as the other scorers
+vectors: array of (term ids, weights), one per query (see query_vector)
+returns tuple: (query number, document, numerator, squared query norm)
+arrays, one item per (query, document) pair with some query term
+    """
+    postptr = doc_tfidf.postptr
+    query_terms = np.array([t for term_ids, _ in vectors for t in term_ids],
+                           dtype=np.int64)
+    query_weights = np.array([w for _, weights in vectors for w in weights])
+    query_of = np.repeat(np.arange(len(vectors)),
+                         [len(term_ids) for term_ids, _ in vectors])
+    
+    # concatenated postings ranges of all the query terms
+    lengths = postptr[query_terms+1] - postptr[query_terms]
+    starts = np.repeat(postptr[query_terms] - (np.cumsum(lengths) - lengths),
+                       lengths)
+    entries = doc_tfidf.postings[np.arange(int(lengths.sum())) + starts]
+    qids = np.repeat(query_of, lengths)
+    qw = np.repeat(query_weights, lengths)
+    
+    # one int64 key per (query, entry) pair; the postings of each query term
+    # are already sorted runs, which the stable sort (timsort) merges
+    order = np.argsort(qids * len(doc_tfidf.data) + entries, kind='stable')
+    entries = entries[order]
+    qids = qids[order]
+    qw = qw[order]
+    rows = doc_tfidf.rows()[entries]
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = (rows[1:] != rows[:-1]) | (qids[1:] != qids[:-1])
+    accumulator = np.cumsum(first) - 1
+    numerator = np.bincount(accumulator, weights=doc_tfidf.data[entries] * qw)
+    query_norm = np.bincount(accumulator, weights=qw * qw)
+    return qids[first], rows[first], numerator, query_norm
+
+
+
+def batch_cosine_similarity(doc_tfidf, queries, topk=0):
+    """
+cosine similarity for a batch of queries (see batch_scores), with the norm
+division done for the whole batch at once; each query's slice is then
+ranked by rank_documents
+returns array of array of ordered tuples:
+    [ [ query_key, [(rank, doc, simil), ...] ], ... ]
+    """
+    init = time.time()
+    vectors = [query_vector(doc_tfidf, query) for query in queries]
+    qids, docs, numerator, query_norm = batch_scores(doc_tfidf, vectors)
+    
+    denominator = doc_tfidf.norms[docs] * np.sqrt(query_norm)
+    match = denominator != 0
+    qids = qids[match]
+    docs = docs[match]
+    similarity = numerator[match] / denominator[match]
+    
+    starts = np.searchsorted(qids, np.arange(len(queries)+1)).tolist()
+    similarities = []
+    for i, query in enumerate(queries):
+        start, end = starts[i], starts[i+1]
+        similarities.append((query['qu keys'],
+                             rank_documents(doc_tfidf, docs[start:end],
+                                            similarity[start:end], topk)))
+    
+    end = time.time() - init
+    metrics.observe('score_batch', end)
+    logger_global.debug('... batch of %s queries finished in %s s',
+                        len(queries), end)
+    return similarities
+
+
+
+def rank_documents(doc_tfidf, docs, similarity, topk=0):
+    """
+sorts the scored documents by similarity (ties in model document order),
+followed by every other document with similarity 0
+topk > 0: only the k best documents with similarity > 0; they are selected
+with a partial sort (np.partition) before sorting
+returns array of ordered tuples: (rank, doc number, similarity)
+    """
+    positive = similarity > 0
+    docs = docs[positive]
+    similarity = similarity[positive]
+    if topk and len(similarity) > topk:
+        # every document tied with the k-th best stays, so the stable sort
+        # below still breaks ties in document order
+        kth = np.partition(similarity, len(similarity)-topk)[-topk]
+        best = similarity >= kth
+        docs = docs[best]
+        similarity = similarity[best]
+    order = np.argsort(-similarity, kind='stable')
+    if topk:
+        order = order[:topk]
+    return ranked_tuples(doc_tfidf, docs[order], similarity[order], topk)
+
+
+
+def ranked_tuples(doc_tfidf, docs, similarity, topk=0):
+    """
+docs, similarity: the ranked documents with similarity > 0
+without topk, every other document follows with similarity 0, in model
+document order
+only the keys of the ranked documents are decoded, except for full
+rankings (every key, decoded once per process)
+returns array of ordered tuples: (rank, doc number, similarity)
+    """
+    ranking = docs.tolist()
+    similarity = similarity.tolist()
+    if not topk:
+        zeros = np.ones(doc_tfidf.n_docs, dtype=bool)
+        zeros[docs] = False
+        ranking += np.flatnonzero(zeros).tolist()
+        similarity += [0.] * (len(ranking) - len(similarity))
+        docs_keys = doc_tfidf.docs_keys()
+        keys = [docs_keys[doc] for doc in ranking]
+    else:
+        keys = doc_tfidf.doc_keys(ranking)
+    
+    return [(rank+1, key, simil) for rank, (key, simil) in
+            enumerate(zip(keys, similarity))]
+
+
+
+def cosine_similarity_minion(doc_tfidf, query, strategy='ACUMULADORES',
+                             topk=0):
+    """
+actually calculates cosine similarity with one of the SCORERS
+the query norm only counts the query terms found in each document
+topk > 0: keeps only the k best documents (see rank_documents)
+returns array of ordered tuples: (rank, doc number, similarity)
+    """
+    with metrics.timer('score') as timer:
+        logger_global.debug('... for query %s', query['qu keys'])
+    
+        term_ids, weights = query_vector(doc_tfidf, query)
+        docs, numerator, query_norm = SCORERS[strategy](doc_tfidf, term_ids,
+                                                        weights, topk)
+        denominator = doc_tfidf.norms[docs] * np.sqrt(query_norm)
+        match = denominator != 0
+        docs = docs[match]
+        similarity = numerator[match] / denominator[match]
+    
+        logger_global.debug('... has nothing in common with %s documents',
+                            doc_tfidf.n_docs - len(docs))
+    
+        result = rank_documents(doc_tfidf, docs, similarity, topk)
+    
+    logger_global.debug('finished in %s s', timer.elapsed)
     return result
 
     
 
-def cosine_similarity(doc_tfidf, qu_tfidf):
+def cosine_similarity(doc_tfidf, qu_tfidf, strategy='ACUMULADORES', topk=0,
+                      workers=1):
     """
 organizes the cosine similarity calculation for all queries
+workers > 1: the queries are spread over a process pool (see
+parallel_cosine_similarity)
 returns array of array of ordered tuples:
     [ [ query_key, [(rank, doc, simil), ...] ], ... ]    
     """
+    if workers > 1:
+        return parallel_cosine_similarity(doc_tfidf, qu_tfidf, strategy, topk,
+                                          workers)
+    
     init = time.time()
-    logger_global.info('Calculating similarity...')
+    logger_global.info('Calculating similarity with strategy %s, top %s...'
+                       % (strategy, topk if topk else 'all'))
     
     similarities = []
-    for query in qu_tfidf:
-        similarities.append((query['qu keys'],
-                             cosine_similarity_minion(doc_tfidf, query)))
+    if strategy == 'LOTE':
+        for start in range(0, len(qu_tfidf), BATCH_SIZE):
+            similarities += batch_cosine_similarity(
+                                doc_tfidf, qu_tfidf[start:start+BATCH_SIZE],
+                                topk)
+    else:
+        for query in qu_tfidf:
+            similarities.append((query['qu keys'],
+                                 cosine_similarity_minion(doc_tfidf, query,
+                                                          strategy, topk)))
         
     end = time.time() - init
     logger_global.info('Similarity calculation completed in %s s' % str(end))
     
     return similarities
+
+
+
+def parallel_cosine_similarity(doc_tfidf, qu_tfidf, strategy, topk, workers):
+    """
+spreads the queries over a pool of worker processes, in chunks; the workers
+attach to one shared copy of the model (the same mapped file, or shared
+memory for a model read from csv) instead of receiving it pickled
+results are collected back in query order
+    """
+    init = time.time()
+    logger_global.info('Calculating similarity with %s worker processes...'
+                       % workers)
+    handle, shm = binary_model.share_model(doc_tfidf)
+    chunk_size = max(1, -(-len(qu_tfidf) // (4*workers)))
+    chunks = [qu_tfidf[start:start+chunk_size]
+              for start in range(0, len(qu_tfidf), chunk_size)]
+    
+    similarities = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=search_worker,
+                                 initargs=(handle,)) as pool:
+            for chunk_similarities, chunk_metrics in pool.map(
+                                                search_minion, chunks,
+                                                [strategy]*len(chunks),
+                                                [topk]*len(chunks)):
+                similarities += chunk_similarities
+                metrics.merge(chunk_metrics)
+    finally:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+    
+    end = time.time() - init
+    logger_global.info('Similarity calculation completed in %s s' % str(end))
+    return similarities
+
+
+
+def search_worker(handle):
+    """
+initializes a pool worker: attaches to the shared model
+    """
+    global worker_model, logger_global
+    # forked workers inherit the coordinator's metrics: start empty
+    metrics.drain()
+    worker_model = binary_model.attach_model(handle)
+    logger_global = logging.getLogger('searcher')
+    # spawned workers don't inherit the parent's handlers
+    if not logger_global.handlers:
+        logger_global.addHandler(logging.NullHandler())
+
+
+
+def search_minion(queries, strategy, topk):
+    """
+actually searches a chunk of queries inside a pool worker
+returns tuple: (array of array of ordered tuples (see cosine_similarity),
+                the worker's metrics for the chunk, see metrics.merge)
+    """
+    return (cosine_similarity(worker_model, queries, strategy, topk),
+            metrics.drain())
+
+
+
+def sharded_cosine_similarity(models, qu_tfidf, strategy='ACUMULADORES',
+                              topk=0):
+    """
+scatter-gather search over document shards (see indexer.write_shards): one
+worker process per shard loads its model, every chunk of queries is sent
+to all shards, and the coordinator merges each query's shard rankings
+models: model files, one per shard, in document order
+returns array of array of ordered tuples (see cosine_similarity)
+    """
+    init = time.time()
+    logger_global.info('Calculating similarity over %s shards...'
+                       % len(models))
+    chunk_size = BATCH_SIZE
+    chunks = [qu_tfidf[start:start+chunk_size]
+              for start in range(0, len(qu_tfidf), chunk_size)]
+    
+    pools = [ProcessPoolExecutor(max_workers=1, initializer=shard_worker,
+                                 initargs=(filename,))
+             for filename in models]
+    similarities = []
+    try:
+        pending = [[pool.submit(search_minion, chunk, strategy, topk)
+                    for chunk in chunks] for pool in pools]
+        for c, chunk in enumerate(chunks):
+            partials = []
+            for shard in pending:
+                shard_similarities, shard_metrics = shard[c].result()
+                partials.append(shard_similarities)
+                metrics.merge(shard_metrics)
+            for i, query in enumerate(chunk):
+                similarities.append((query['qu keys'], merge_rankings(
+                    [partial[i][1] for partial in partials], topk)))
+    finally:
+        for pool in pools:
+            pool.shutdown()
+    
+    end = time.time() - init
+    logger_global.info('Similarity calculation completed in %s s' % str(end))
+    return similarities
+
+
+
+def shard_worker(filename):
+    """
+initializes a shard worker: reads (maps) its shard of the model
+    """
+    global worker_model, logger_global
+    metrics.drain()
+    logger_global = logging.getLogger('searcher')
+    if not logger_global.handlers:
+        logger_global.addHandler(logging.NullHandler())
+    worker_model = read_any_model(filename)
+
+
+
+def merge_rankings(rankings, topk=0):
+    """
+merges the rankings of one query from every shard, shards in document
+order: documents with similarity > 0 by similarity (ties: shard order, then
+rank in the shard, i.e. document order), then without topk the
+documents with similarity 0 of each shard, in shard order
+returns array of ordered tuples: (rank, doc number, similarity)
+    """
+    positive = [[item for item in ranking if item[2] > 0]
+                for ranking in rankings]
+    merged = heapq.merge(*positive, key=lambda item: -item[2])
+    if topk:
+        merged = islice(merged, topk)
+    else:
+        merged = chain(merged, *[[item for item in ranking if item[2] <= 0]
+                                 for ranking in rankings])
+    return [(rank+1, doc, simil) for rank, (_, doc, simil) in
+            enumerate(merged)]
+
+
+
+def cached_similarity(cache, search, qu_tfidf, topk=0):
+    """
+answers the queries found in the result cache (see result_cache) and
+searches only the others, each distinct query once; the cache must already
+be bound to the model signature
+search: function(queries) -> similarities (e.g. cosine_similarity)
+returns array of array of ordered tuples (see cosine_similarity)
+    """
+    keys = [query_key(query, topk) for query in qu_tfidf]
+    found = {}
+    pending = {}
+    for key, query in zip(keys, qu_tfidf):
+        if key in found or key in pending:
+            cache.hits += 1
+            continue
+        result = cache.get(key)
+        if result is None:
+            pending[key] = query
+        else:
+            found[key] = result
     
+    for key, (_, result) in zip(pending, search(list(pending.values()))):
+        found[key] = result
+        cache.put(key, result)
+    
+    return [(query['qu keys'], found[key])
+            for key, query in zip(keys, qu_tfidf)]
+
 
 
 def write_results(filepath, results):
@@ -237,6 +882,7 @@ write tfidf in csv file
             csv_writer.writerow(row)
     
     end = time.time() - init
+    metrics.observe('write', end)
     logger_global.info('Write operation finished with %s s' % str(end))
 
 
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 15:02:47 2026
+@author: thabata
+
+segment-based incremental indexing: each batch of new xml files becomes an
+immutable segment (binary index, see binary_index) in the segments
+directory, next to the manifest (segments.json) with
+- generation, bumped on every change
+- segments in doc order, their doc counts and the xml files they came from
+- collection statistics, updated as segments are added: docs with tokens,
+  maximum frequency and df per token
+- segments retired by merges, and the generation that retired them
+- the identity of the index (a uuid given when the manifest is created),
+  so a model built from another segments directory that reached the same
+  generation is not taken as current
+a merge policy combines runs of similar-sized neighbouring segments
+the counter of segment names is kept apart (names.json), so reserving a
+name doesn't rewrite the statistics
+
+what is incremental: parsing, tokenizing and inverting (only the new xml
+files) and the collection statistics (added per segment, never recomputed)
+what isn't: the TF*IDF model. Every new segment changes N and the df of
+its tokens, so the IDF and the norm of documents of every segment; the
+indexer rebuilds the whole model from all segments (read_segments) and the
+searcher reads that model, not the segments. The indexer skips the rebuild
+when its model is already at the manifest generation
+"""
+
+from binary_index import Lexicon, write_index
+from math import log
+import json
+import uuid
+import os
+
+MANIFEST = 'segments.json'
+NAMES = 'names.json'
+# segments merged at once, and size ratio between tiers
+MERGE_FACTOR = 4
+
+
+
+def load_json(filepath, default):
+    try:
+        with open(filepath, 'r') as json_file:
+            return json.load(json_file)
+    except FileNotFoundError:
+        return default
+
+
+
+def save_json(filepath, data):
+    """
+writes json atomically (temporary file + rename)
+    """
+    with open(filepath+'.tmp', 'w') as json_file:
+        json.dump(data, json_file)
+    os.replace(filepath+'.tmp', filepath)
+
+
+
+def load_manifest(seg_dir):
+    """
+returns dictionary: the manifest, an empty one when there is none yet
+(both get an identity if they lack one; it is kept on the next save)
+    """
+    manifest = load_json(os.path.join(seg_dir, MANIFEST),
+                         {'generation': 0, 'segments': [], 'retired': [],
+                          'stats': {'n_docs': 0, 'maxf': 0, 'df': {}}})
+    manifest.setdefault('index', uuid.uuid4().hex)
+    return manifest
+
+
+
+def indexed_sources(seg_dir):
+    """
+returns set of xml files already indexed in some segment
+    """
+    os.makedirs(seg_dir, exist_ok=True)
+    return {source for segment in load_manifest(seg_dir)['segments']
+                   for source in segment['sources']}
+
+
+
+def segment_path(seg_dir, name):
+    return os.path.join(seg_dir, name+'.lex')
+
+
+
+def new_segment_name(seg_dir):
+    """
+reserves the next segment name (NAMES file; manifests written before it
+kept the counter themselves)
+returns string
+    """
+    names = load_json(os.path.join(seg_dir, NAMES),
+                      {'next': load_manifest(seg_dir).get('next', 0)})
+    name = 'seg%06d' % names['next']
+    names['next'] += 1
+    save_json(os.path.join(seg_dir, NAMES), names)
+    return name
+
+
+
+def remove_retired(seg_dir, manifest):
+    """
+deletes the files of the segments retired before the manifest's current
+generation: a reader that loaded an older manifest has had a whole
+generation to finish; the ones retired by the latest change stay until the
+next one
+returns array of the segment names deleted
+    """
+    removed = []
+    kept = []
+    for retired in manifest.get('retired', []):
+        if retired['generation'] >= manifest['generation']:
+            kept.append(retired)
+            continue
+        for ext in ('.lex', '.pst'):
+            try: os.remove(os.path.join(seg_dir, retired['name']+ext))
+            except FileNotFoundError: pass
+        removed.append(retired['name'])
+    manifest['retired'] = kept
+    return removed
+
+
+
+def add_segment(seg_dir, inv_ix, docs_keys, sources):
+    """
+writes a new segment and updates the collection statistics with it
+inv_ix: iterable of (token, postings), doc ids local to the segment
+returns segment name
+    """
+    stats = {'n_docs': 0, 'maxf': 0, 'df': {}}
+    df = stats['df']
+    has_tokens = bytearray(len(docs_keys))
+
+    def counted(items):
+        for token, postings in items:
+            token = token.upper()
+            df[token] = df.get(token, 0) + len(postings)//2
+            stats['maxf'] = max(stats['maxf'], max(postings[1::2]))
+            for i in range(0, len(postings), 2):
+                has_tokens[postings[i]] = 1
+            yield token, postings
+
+    name = new_segment_name(seg_dir)
+    write_index(segment_path(seg_dir, name), counted(inv_ix), docs_keys)
+    stats['n_docs'] = sum(has_tokens)
+
+    manifest = load_manifest(seg_dir)
+    remove_retired(seg_dir, manifest)
+    manifest['segments'].append({'name': name,
+                                 'n_docs': len(docs_keys),
+                                 'sources': sources})
+    totals = manifest['stats']
+    totals['n_docs'] += stats['n_docs']
+    totals['maxf'] = max(totals['maxf'], stats['maxf'])
+    for token, freq in df.items():
+        totals['df'][token] = totals['df'].get(token, 0) + freq
+    manifest['generation'] += 1
+    save_json(os.path.join(seg_dir, MANIFEST), manifest)
+    return name
+
+
+
+def merge_candidates(manifest):
+    """
+tiered merge policy: finds MERGE_FACTOR neighbouring segments in the same
+size tier (tier = floor(log_MERGE_FACTOR(docs)))
+returns array of segment names, empty if nothing to merge
+    """
+    tiers = [int(log(max(segment['n_docs'], 1), MERGE_FACTOR))
+             for segment in manifest['segments']]
+    for start in range(len(tiers) - MERGE_FACTOR + 1):
+        window = tiers[start:start+MERGE_FACTOR]
+        if min(window) == max(window):
+            return [segment['name'] for segment in
+                    manifest['segments'][start:start+MERGE_FACTOR]]
+    return []
+
+
+
+def merge_segments(seg_dir, names):
+    """
+merges neighbouring segments into one new segment, then swaps them in the
+manifest (statistics don't change: same documents)
+the merged segments are only retired: readers of the previous manifest may
+still be reading them (see remove_retired)
+    """
+    name = new_segment_name(seg_dir)
+    manifest = load_manifest(seg_dir)
+    segments = [s for s in manifest['segments'] if s['name'] in names]
+
+    docs_keys, inv_ix = read_postings(seg_dir, segments)
+    write_index(segment_path(seg_dir, name), inv_ix.items(), docs_keys)
+
+    position = [s['name'] for s in manifest['segments']].index(names[0])
+    manifest['segments'][position:position+len(names)] = \
+        [{'name': name,
+          'n_docs': sum(s['n_docs'] for s in segments),
+          'sources': [src for s in segments for src in s['sources']]}]
+    manifest['generation'] += 1
+    manifest.setdefault('retired', []).extend(
+        {'name': old, 'generation': manifest['generation']} for old in names)
+    save_json(os.path.join(seg_dir, MANIFEST), manifest)
+
+
+
+def merge_policy(seg_dir):
+    """
+merges segments until the policy finds nothing else to merge
+returns number of merges
+    """
+    merges = 0
+    names = merge_candidates(load_manifest(seg_dir))
+    while names:
+        merge_segments(seg_dir, names)
+        merges += 1
+        names = merge_candidates(load_manifest(seg_dir))
+    return merges
+
+
+
+def read_postings(seg_dir, segments):
+    """
+reads segments as one index, doc ids shifted by each segment's doc base
+returns tuple: (array of document keys, dictionary of postings)
+    """
+    docs_keys = []
+    inv_ix = {}
+    for segment in segments:
+        lexicon = Lexicon(segment_path(seg_dir, segment['name']))
+        base = len(docs_keys)
+        docs_keys += lexicon.docs_keys()
+        for token, postings in lexicon.items():
+            if base:
+                for i in range(0, len(postings), 2):
+                    postings[i] += base
+            try: inv_ix[token].extend(postings)
+            except KeyError: inv_ix[token] = postings
+        lexicon.close()
+    return docs_keys, inv_ix
+
+
+
+def read_segments(seg_dir):
+    """
+reads every segment of the collection plus its statistics
+returns tuple: (array of document keys, dictionary of postings, stats)
+    """
+    manifest = load_manifest(seg_dir)
+    docs_keys, inv_ix = read_postings(seg_dir, manifest['segments'])
+    stats = manifest['stats']
+    stats['generation'] = manifest['generation']
+    stats['index'] = manifest['index']
+    return docs_keys, inv_ix, stats
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 21:40:18 2026
+@author: thabata
+
+paired significance tests between two retrieval runs, on the per-query
+differences of every measure at once (see evaluation.per_query):
+- randomization test: random sign flips of the differences
+- bootstrap: queries resampled with replacement; percentile confidence
+  interval and p-value of the centred bootstrap distribution
+
+resamples are drawn in blocks and every block is one matrix product
+((resamples x queries) @ (queries x measures)), so tens of thousands of
+resamples take a fraction of a second
+"""
+
+import numpy as np
+
+RESAMPLES = 10000
+# resamples drawn at once, bounds the memory (BLOCK x queries floats)
+BLOCK = 5000
+CONFIDENCE = 0.95
+# differences this close to the observed one count as ties (float noise)
+TIES = 1e-12
+
+
+
+def blocks(resamples):
+    """
+yields the size of each block of resamples
+    """
+    for start in range(0, resamples, BLOCK):
+        yield min(BLOCK, resamples - start)
+
+
+
+def randomization_test(deltas, resamples=RESAMPLES, rng=None):
+    """
+deltas: (queries x measures) array of per-query differences
+returns array of two-sided p-values, one per measure
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    n = len(deltas)
+    observed = np.abs(deltas.mean(axis=0))
+    extreme = np.zeros(deltas.shape[1], dtype=np.int64)
+    for size in blocks(resamples):
+        signs = rng.integers(0, 2, size=(size, n)) * 2. - 1.
+        means = signs @ deltas / n
+        extreme += (np.abs(means) >= observed - TIES).sum(axis=0)
+    return (extreme + 1) / (resamples + 1)
+
+
+
+def bootstrap_test(deltas, resamples=RESAMPLES, rng=None,
+                   confidence=CONFIDENCE):
+    """
+deltas: (queries x measures) array of per-query differences
+returns tuple of arrays, one value per measure: (two-sided p-values, lower
+and upper bounds of the confidence interval of the mean difference)
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    n = len(deltas)
+    observed = deltas.mean(axis=0)
+    means = []
+    for size in blocks(resamples):
+        # how many times each query is drawn in each resample
+        counts = rng.multinomial(n, np.full(n, 1./n), size=size)
+        means.append(counts @ deltas / n)
+    means = np.concatenate(means)
+    extreme = (np.abs(means - observed) >= np.abs(observed) - TIES).sum(axis=0)
+    tail = (1 - confidence) / 2
+    low, high = np.quantile(means, [tail, 1 - tail], axis=0)
+    return (extreme + 1) / (resamples + 1), low, high
+
+
+
+def compare(baseline, other, resamples=RESAMPLES, seed=0):
+    """
+baseline, other: (queries x measures) arrays, same queries in the same
+order
+returns dictionary of arrays, one value per measure: means of both runs,
+mean difference (other - baseline), p-values of both tests and bootstrap
+confidence interval
+    """
+    rng = np.random.default_rng(seed)
+    deltas = other - baseline
+    p_randomization = randomization_test(deltas, resamples, rng)
+    p_bootstrap, low, high = bootstrap_test(deltas, resamples, rng)
+    return {'baseline': baseline.mean(axis=0),
+            'other': other.mean(axis=0),
+            'delta': deltas.mean(axis=0),
+            'p_randomization': p_randomization,
+            'p_bootstrap': p_bootstrap,
+            'ci_low': low,
+            'ci_high': high}
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 14:20:31 2026
+@author: thabata
+
+block-based (SPIMI) construction of the inverted index: postings are
+collected in memory until a memory budget is reached, then the block is
+written to disk as a sorted run; at the end all runs are k-way merged
+"""
+
+from binary_index import encode_postings, decode_postings
+from collections import Counter
+from itertools import groupby
+from array import array
+import heapq
+import os
+import shutil
+import tempfile
+
+# rough cost of a new term in a block: str, dict slot and empty array
+TERM_OVERHEAD = 200
+# one (doc id, frequency) pair in array('I')
+PAIR_SIZE = 2*array('I').itemsize
+
+
+
+class BlockIndexer:
+    """
+builds inverted index blocks of at most budget bytes (estimated)
+doc ids are global and increasing, so the postings of one term are the
+concatenation of its postings in each run, in run order
+    """
+
+    def __init__(self, budget, run_dir=None):
+        self.budget = budget
+        self.run_dir = tempfile.mkdtemp(prefix='spimi-', dir=run_dir)
+        self.runs = []
+        self.block = {}
+        self.used = 0
+        self.n_docs = 0
+
+
+    def add(self, tokens):
+        """
+adds one tokenized document to the current block
+flushes the block when the budget is reached
+returns the doc id given to the document
+        """
+        doc_id = self.n_docs
+        self.n_docs += 1
+        block = self.block
+        for token, freq in Counter(tokens).items():
+            try: postings = block[token]
+            except KeyError:
+                postings = block[token] = array('I')
+                self.used += TERM_OVERHEAD
+            postings.append(doc_id)
+            postings.append(freq)
+            self.used += PAIR_SIZE
+
+        if self.used >= self.budget:
+            self.flush()
+        return doc_id
+
+
+    def flush(self):
+        """
+writes the current block as a sorted run and empties it
+        """
+        if not self.block:
+            return
+        filepath = os.path.join(self.run_dir, 'run%05d' % len(self.runs))
+        with open(filepath, 'wb') as run_file:
+            for token in sorted(self.block):
+                write_record(run_file, token, self.block[token])
+        self.runs.append(filepath)
+        self.block = {}
+        self.used = 0
+
+
+    def merge(self):
+        """
+k-way merges all runs
+yields (token, postings) in sorted token order
+        """
+        self.flush()
+        streams = [read_run(filepath, n) for n, filepath in enumerate(self.runs)]
+        for token, group in groupby(heapq.merge(*streams),
+                                    key=lambda record: record[0]):
+            postings = array('I')
+            for _, _, partial in group:
+                postings.extend(partial)
+            yield token, postings
+
+
+    def close(self):
+        """
+removes the run files
+        """
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+
+
+
+def write_varint(out, value):
+    buf = bytearray()
+    while value > 0x7f:
+        buf.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buf.append(value)
+    out.write(buf)
+
+
+
+def read_varint(stream):
+    """
+returns the next varint in stream, or None at the end of the stream
+    """
+    value = shift = 0
+    while True:
+        byte = stream.read(1)
+        if not byte:
+            return None
+        value |= (byte[0] & 0x7f) << shift
+        if not byte[0] & 0x80:
+            return value
+        shift += 7
+
+
+
+def write_record(out, token, postings):
+    """
+run record: token length, token, postings length, encoded postings
+    """
+    token = token.encode('utf-8')
+    buf = encode_postings(postings)
+    write_varint(out, len(token))
+    out.write(token)
+    write_varint(out, len(buf))
+    out.write(buf)
+
+
+
+def read_run(filepath, run_number):
+    """
+yields run records as tuples: (token, run number, postings)
+    """
+    with open(filepath, 'rb') as run_file:
+        while True:
+            size = read_varint(run_file)
+            if size is None:
+                return
+            token = run_file.read(size).decode('utf-8')
+            size = read_varint(run_file)
+            yield token, run_number, decode_postings(run_file.read(size))
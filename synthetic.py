@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 22:30:41 2026
+@author: thabata
+
+synthetic collections in the CF schema (cfc-2.dtd records, cfcquery-2.dtd
+queries with their expected results) for the scaling benchmark, modelled on
+the real collection in 1-DATA:
+- scale 1 has as many documents as CF, scale n n times as many
+- words: the CF vocabulary with its frequencies, plus new words continuing
+  its Zipf tail as the collection grows (Heaps' law: vocabulary grows with
+  scale**HEAPS)
+- document and query lengths resampled from the CF ones
+- relevant documents: each document is relevant to about as many queries as
+  in CF and gets some of their topic terms planted, so the number of
+  relevant documents per query grows with the scale
+"""
+
+from xml.etree.ElementTree import iterparse
+import numpy as np
+import shutil
+import glob
+import re
+import os
+
+WORDS = re.compile(r'[a-z]+')
+HEAPS = 0.5
+# records per xml file
+RECORDS = 10000
+# topic terms of a query are taken from the CF vocabulary, skipping the
+# most frequent words
+TOPIC_FROM = 50
+SYLLABLES = [c + v for c in 'bcdfghklmnprstvz' for v in 'aeiou']
+
+
+
+def cf_model(path):
+    """
+reads the CF collection in path/1-DATA
+returns dictionary: words (by decreasing frequency) and their counts,
+document lengths, query lengths, number of queries and mean number of
+relevant queries per document
+    """
+    counts = {}
+    doc_lengths = []
+    for filename in sorted(glob.glob(path+'/1-DATA/cf7*.xml')):
+        for _, elem in iterparse(filename):
+            if elem.tag != 'RECORD':
+                continue
+            text = elem.findtext('ABSTRACT') or elem.findtext('EXTRACT')
+            elem.clear()
+            if not text:
+                continue
+            words = WORDS.findall(text.lower())
+            doc_lengths.append(len(words))
+            for word in words:
+                counts[word] = counts.get(word, 0) + 1
+
+    query_lengths = []
+    relevant = 0
+    for _, elem in iterparse(path+'/1-DATA/cfquery.xml'):
+        if elem.tag != 'QUERY':
+            continue
+        query_lengths.append(len(WORDS.findall(
+                                 elem.findtext('QueryText').lower())))
+        relevant += len(list(elem.find('Records').iter('Item')))
+        elem.clear()
+
+    words = sorted(counts, key=lambda word: (-counts[word], word))
+    return {'words': words,
+            'counts': np.array([counts[word] for word in words], dtype=float),
+            'doc_lengths': np.array(doc_lengths),
+            'query_lengths': np.array(query_lengths),
+            'queries': len(query_lengths),
+            'relevant': relevant / len(doc_lengths)}
+
+
+
+def synthetic_word(rank):
+    """
+returns a pronounceable word made of the syllables of rank (base
+len(SYLLABLES)), different for every rank
+    """
+    word = ''
+    while True:
+        rank, digit = divmod(rank, len(SYLLABLES))
+        word += SYLLABLES[digit]
+        if not rank:
+            return word + 'x'
+        rank -= 1
+
+
+
+def vocabulary(model, scale):
+    """
+returns tuple: (array of words, their probabilities); the CF words first,
+then the new words of the tail (frequency ~ 1/rank)
+    """
+    known = len(model['words'])
+    total = int(known * scale**HEAPS)
+    ranks = np.arange(known, total)
+    tail = model['counts'][-1] * known / (ranks + 1.)
+    counts = np.concatenate([model['counts'], tail])
+    words = model['words'] + [synthetic_word(int(r)) for r in ranks]
+    return words, counts / counts.sum()
+
+
+
+def generate(path, outdir, scale, n_queries=None, seed=0):
+    """
+writes a synthetic collection scale times CF in outdir/1-DATA
+n_queries: number of queries (default: as many as CF)
+returns dictionary: document files, query file, number of documents and of
+queries
+    """
+    rng = np.random.default_rng(seed)
+    model = cf_model(path)
+    words, probabilities = vocabulary(model, scale)
+    words = np.array(words, dtype=object)
+    n_docs = int(round(len(model['doc_lengths']) * scale))
+    n_queries = n_queries or model['queries']
+    data_dir = outdir+'/1-DATA'
+    os.makedirs(data_dir, exist_ok=True)
+    for dtd in ('cfc-2.dtd', 'cfcquery-2.dtd'):
+        shutil.copy(path+'/1-DATA/'+dtd, data_dir)
+
+    # queries: topic terms (the ones planted in relevant documents) and
+    # common words drawn from the collection
+    lengths = rng.choice(model['query_lengths'], n_queries)
+    topics = []
+    texts = []
+    for length in lengths:
+        size = max(2, length // 2)
+        topic = rng.choice(np.arange(TOPIC_FROM, len(model['words'])), size,
+                           replace=False)
+        common = rng.choice(len(words), max(length - size, 0),
+                            p=probabilities)
+        topics.append(topic)
+        texts.append(' '.join(words[np.concatenate([topic, common])]))
+
+    # documents, RECORDS per file
+    relevant = [[] for _ in range(n_queries)]
+    rate = model['relevant'] * n_queries / model['queries']
+    doc_files = []
+    for first in range(0, n_docs, RECORDS):
+        count = min(RECORDS, n_docs - first)
+        lengths = rng.choice(model['doc_lengths'], count)
+        tokens = np.split(rng.choice(len(words), lengths.sum(),
+                                     p=probabilities),
+                          np.cumsum(lengths)[:-1])
+        n_relevant = np.minimum(rng.poisson(rate, count), n_queries)
+        filename = '%s/cf%05d.xml' % (data_dir, len(doc_files))
+        with open(filename, 'w') as xml:
+            xml.write('<?xml version="1.0"?>\n'
+                      '<!DOCTYPE FILE SYSTEM "cfc-2.dtd">\n<FILE>\n')
+            for i in range(count):
+                docnum = first + i + 1
+                ids = [tokens[i]]
+                for query in rng.choice(n_queries, n_relevant[i],
+                                        replace=False):
+                    topic = topics[query]
+                    ids.append(rng.choice(topic, rng.integers(1, len(topic)+1),
+                                          replace=False))
+                    relevant[query].append(docnum)
+                write_record(xml, docnum, ' '.join(words[np.concatenate(ids)]))
+            xml.write('</FILE>\n')
+        doc_files.append(filename)
+
+    query_file = data_dir+'/cfquery.xml'
+    write_queries(query_file, texts, relevant, rng)
+    return {'documents': doc_files, 'queries': query_file,
+            'n_documents': n_docs, 'n_queries': n_queries}
+
+
+
+def write_record(xml, docnum, text):
+    """
+writes one RECORD, with the fields the indexer reads
+    """
+    xml.write('\t<RECORD>\n'
+              '\t\t<PAPERNUM>PN%05d</PAPERNUM>\n'
+              '\t\t<RECORDNUM>%05d </RECORDNUM>\n'
+              '\t\t<ABSTRACT>%s</ABSTRACT>\n'
+              '\t</RECORD>\n' % (docnum, docnum, text))
+
+
+
+def write_queries(filepath, texts, relevant, rng):
+    """
+writes the queries and their expected results; relevance scores are
+random, 4 digits from 0 to 2, at least one of them not 0
+    """
+    with open(filepath, 'w') as xml:
+        xml.write('<?xml version="1.0"?>\n'
+                  '<!DOCTYPE FILEQUERY SYSTEM "cfcquery-2.dtd">\n'
+                  '<FILEQUERY>\n')
+        for i, (text, docs) in enumerate(zip(texts, relevant)):
+            scores = rng.integers(0, 3, (len(docs), 4))
+            scores[scores.sum(axis=1) == 0, 3] = 1
+            xml.write('\t<QUERY>\n'
+                      '\t\t<QueryNumber>%05d</QueryNumber>\n'
+                      '\t\t<QueryText>%s</QueryText>\n'
+                      '\t\t<Results>%05d</Results>\n'
+                      '\t\t<Records>\n' % (i+1, text, len(docs)))
+            for doc, score in zip(docs, scores):
+                xml.write('\t\t\t<Item score="%s">%s</Item>\n' %
+                          (''.join(map(str, score)), doc))
+            xml.write('\t\t</Records>\n\t</QUERY>\n')
+        xml.write('</FILEQUERY>\n')